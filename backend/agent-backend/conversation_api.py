@@ -1,10 +1,16 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import threading
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ThreadPoolExecutor
 from collections import deque
-import requests
+import orjson
+import os
+import queue as queue_module
+import threading
+import time
 from google.genai import types
-from gemini_helpers import call_google_llm_with_tools, parse_function_call, extract_text_response
+from gemini_helpers import call_google_llm_with_tools, parse_function_calls, extract_text_response, prewarm_gemini_client
 from tools import (
     get_zone_summary,
     get_personnel_status,
@@ -20,7 +26,21 @@ from tools import (
     dispatch_fire_brigade
 )
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Tool mapping from function name to actual function
@@ -39,17 +59,56 @@ TOOL_FUNCTIONS = {
     "dispatch_fire_brigade": dispatch_fire_brigade
 }
 
+# Port the API listens on, read once at import time
+PORT = int(os.environ.get('PORT', 5001))
+
+# Upper bound on tracked sessions; least recently used ones are evicted
+MAX_SESSIONS = 1024
+
+# Seconds an alert queue is kept before it expires
+ALERT_QUEUE_TTL_SECONDS = 3600
+
 # Store conversation sessions
-sessions = {}
+sessions = LRUCache(maxsize=MAX_SESSIONS)
 
 # Response queues for streaming
-response_queues = {}
+response_queues = LRUCache(maxsize=MAX_SESSIONS)
+
+# Seconds between SSE keepalive comments while waiting for new items
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Seconds /poll blocks waiting for the first item before returning empty
+POLL_TIMEOUT_SECONDS = 25
 
 # Alert queues for each session
-alert_queues = {}
+alert_queues = TTLCache(maxsize=MAX_SESSIONS, ttl=ALERT_QUEUE_TTL_SECONDS)
+
+# Sessions whose client has chatted or polled recently, mapped to the
+# monotonic time of that activity; entries expire after the TTL
+ACTIVE_SESSION_TTL_SECONDS = 600
+active_sessions = TTLCache(maxsize=MAX_SESSIONS, ttl=ACTIVE_SESSION_TTL_SECONDS)
+
+# Alerts without a session_id go to the most recently active session. Each
+# alert runs a tool-calling loop that acts on the shared simulator, so sending
+# it to every active session instead must be switched on explicitly.
+ALERT_BROADCAST = os.environ.get('ALERT_BROADCAST', 'false').lower() == 'true'
+
+# cachetools caches are not thread-safe; guards sessions, the queue maps and active_sessions
+session_store_lock = threading.Lock()
 
-# Track most recent session for alerts
-most_recent_session = None
+# Maximum number of messages re-sent to the LLM per turn
+MAX_HISTORY_MESSAGES = 64
+
+# Shared worker pool for background LLM processing (avoids a new thread per request)
+MAX_PROCESSING_WORKERS = 16
+processing_executor = ThreadPoolExecutor(max_workers=MAX_PROCESSING_WORKERS, thread_name_prefix='chat-worker')
+
+# Shared pool for running tool calls from one LLM response concurrently
+MAX_TOOL_WORKERS = 8
+tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix='tool-worker')
+
+# Open the Gemini connection in the background so the first chat skips the TLS handshake
+processing_executor.submit(prewarm_gemini_client)
 
 def setup_tool_declarations():
     """Set up the function declarations for the tool calling API."""
@@ -238,6 +297,64 @@ def setup_tool_declarations():
         ),
     ]
 
+def _get_session(session_id):
+    """Return the session for session_id, creating it if needed."""
+    with session_store_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = {
+                'messages': [],
+                'tools': SHARED_TOOL
+            }
+    return session
+
+def _touch_session(session_id):
+    """Record client activity on session_id, for routing alerts without a session_id."""
+    with session_store_lock:
+        active_sessions[session_id] = time.monotonic()
+
+def _alert_session_ids():
+    """Sessions that receive an alert sent without a session_id."""
+    with session_store_lock:
+        if ALERT_BROADCAST and active_sessions:
+            return list(active_sessions.keys())
+        latest = max(active_sessions.items(), key=lambda item: item[1], default=None)
+    return [latest[0] if latest else 'default']
+
+def _get_response_queue(session_id):
+    """Return the response queue for session_id, creating it if needed."""
+    with session_store_lock:
+        queue = response_queues.get(session_id)
+        if queue is None:
+            queue = response_queues[session_id] = queue_module.SimpleQueue()
+    return queue
+
+def _get_alert_queue(session_id):
+    """Return the alert queue for session_id, creating it if needed."""
+    with session_store_lock:
+        alert_queue = alert_queues.get(session_id)
+        if alert_queue is None:
+            alert_queue = alert_queues[session_id] = deque()
+    return alert_queue
+
+def _is_user_text(content):
+    """Whether a message is a user turn (as opposed to a function response)."""
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+def _trim_history(messages):
+    """Drop the oldest whole turns so at most MAX_HISTORY_MESSAGES remain.
+
+    Cuts only at user text messages so function calls are never separated
+    from their function responses.
+    """
+    excess = len(messages) - MAX_HISTORY_MESSAGES
+    if excess <= 0:
+        return
+    
+    boundaries = [i for i, content in enumerate(messages) if _is_user_text(content)]
+    cut = next((i for i in boundaries if i >= excess), boundaries[-1] if boundaries else 0)
+    del messages[:cut]
+
 def get_system_prompt():
     return """
 You are **Project Drishti**, an AI-powered situational awareness platform for large-scale event safety. Your primary mission is to act as a proactive central nervous system for the event's command center, providing actionable intelligence and executing commands to ensure attendee safety.
@@ -283,21 +400,25 @@ Your primary directive is to **maintain event safety and stability**.
 - Even if the user talks in another language, you must make the tool calls in English and the tool responses will also be in English. You must respond to the user in the language that the user is using.
 """
 
+# Built once at import; both are static for the lifetime of the process
+SYSTEM_PROMPT = get_system_prompt()
+TOOL_DECLARATIONS = setup_tool_declarations()
+SHARED_TOOL = types.Tool(function_declarations=TOOL_DECLARATIONS)
+
 def execute_function_call(function_call):
     """Execute a function call and return the result."""
     function_name = function_call.name
     
-    # Parse arguments
-    args = {}
-    if hasattr(function_call, 'args') and function_call.args:
-        args = dict(function_call.args)
+    # FunctionCall.args is already a plain dict; use it without copying
+    args = function_call.args or {}
     
-    # Execute the function
-    if function_name in TOOL_FUNCTIONS:
+    # Execute the function (single hash lookup)
+    tool_function = TOOL_FUNCTIONS.get(function_name)
+    if tool_function is not None:
         try:
-            result = TOOL_FUNCTIONS[function_name](**args)
+            result = tool_function(**args)
             return {
-                "result": str(result),
+                "result": result,
                 "function_name": function_name,
                 "args": args
             }
@@ -313,39 +434,26 @@ def execute_function_call(function_call):
             "function_name": function_name
         }
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Handle chat messages from the web UI."""
-    data = request.get_json()
-    session_id = data.get('session_id', 'default')
-    user_message = data.get('message', '')
-    
-    # Initialize session and queue if needed
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'messages': [],
-            'tools': types.Tool(function_declarations=setup_tool_declarations())
-        }
-    if session_id not in response_queues:
-        response_queues[session_id] = deque()
-    if session_id not in alert_queues:
-        alert_queues[session_id] = deque()
-    
-    # Track this as most recent session
-    global most_recent_session
-    most_recent_session = session_id
-    
-    session = sessions[session_id]
-    queue = response_queues[session_id]
+def start_session_processing(session_id, user_message):
+    """Add a user message to a session and process it on the worker pool."""
+    # Initialize session and queues if needed
+    session = _get_session(session_id)
+    queue = _get_response_queue(session_id)
+    _get_alert_queue(session_id)
     
     # Add user message
     session['messages'].append(types.Content(
         role="user",
         parts=[types.Part.from_text(text=user_message)]
     ))
+    _trim_history(session['messages'])
     
     # Clear queue for new conversation
-    queue.clear()
+    while not queue.empty():
+        try:
+            queue.get_nowait()
+        except queue_module.Empty:
+            break
     
     # Start processing in background thread
     def process_async():
@@ -354,29 +462,26 @@ def chat():
                 request_id=None,
                 model="gemini-2.5-flash",
                 messages=session['messages'],
-                sp=get_system_prompt(),
-                tools=[session['tools']],
+                sp=SYSTEM_PROMPT,
+                tools=[SHARED_TOOL],
                 user_id=None
             )
             
             # Handle function calls
             max_function_calls = 15
             function_call_count = 0
-            first_text_sent = False
             
             while function_call_count < max_function_calls:
-                has_function_call, function_call = parse_function_call(response)
+                function_calls = parse_function_calls(response)
                 
-                if has_function_call:
-                    # Extract any text before the function call
+                if function_calls:
+                    # Send any text that accompanies the function calls
                     text_response = extract_text_response(response)
-                    if text_response and not first_text_sent:
-                        # Send initial text immediately
-                        queue.append({
+                    if text_response:
+                        queue.put({
                             'type': 'text',
                             'content': text_response
                         })
-                        first_text_sent = True
                     
                     function_call_count += 1
                     
@@ -384,22 +489,29 @@ def chat():
                     if response.candidates and response.candidates[0].content:
                         session['messages'].append(response.candidates[0].content)
                     
-                    # Execute function and send to queue immediately
-                    function_result = execute_function_call(function_call)
-                    queue.append({
-                        'type': 'function_call',
-                        'content': function_result
-                    })
+                    # Execute functions, concurrently when the model requested several
+                    if len(function_calls) == 1:
+                        function_results = [execute_function_call(function_calls[0])]
+                    else:
+                        futures = [tool_executor.submit(execute_function_call, function_call)
+                                   for function_call in function_calls]
+                        function_results = [future.result() for future in futures]
                     
-                    # Create function response
-                    function_response_part = types.Part.from_function_response(
-                        name=function_call.name,
-                        response={"result": function_result.get("result", function_result.get("error", "Unknown error"))}
-                    )
+                    # Send results to queue and create function responses
+                    function_response_parts = []
+                    for function_call, function_result in zip(function_calls, function_results):
+                        queue.put({
+                            'type': 'function_call',
+                            'content': function_result
+                        })
+                        function_response_parts.append(types.Part.from_function_response(
+                            name=function_call.name,
+                            response={"result": function_result.get("result", function_result.get("error", "Unknown error"))}
+                        ))
                     
                     session['messages'].append(types.Content(
                         role="user",
-                        parts=[function_response_part]
+                        parts=function_response_parts
                     ))
                     
                     # Get next response
@@ -407,15 +519,15 @@ def chat():
                         request_id=None,
                         model="gemini-2.5-flash",
                         messages=session['messages'],
-                        sp=get_system_prompt(),
-                        tools=[session['tools']],
+                        sp=SYSTEM_PROMPT,
+                        tools=[SHARED_TOOL],
                         user_id=None
                     )
                 else:
                     # No more function calls
                     text = extract_text_response(response)
                     if text:
-                        queue.append({
+                        queue.put({
                             'type': 'text',
                             'content': text
                         })
@@ -426,18 +538,26 @@ def chat():
                     break
             
             # Mark end of response
-            queue.append({'type': 'end'})
+            queue.put({'type': 'end'})
             
         except Exception as e:
-            queue.append({
+            queue.put({
                 'type': 'error',
                 'content': str(e)
             })
     
-    # Start processing thread
-    thread = threading.Thread(target=process_async)
-    thread.daemon = True
-    thread.start()
+    # Hand processing to the shared worker pool
+    processing_executor.submit(process_async)
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """Handle chat messages from the web UI."""
+    data = request.get_json()
+    session_id = data.get('session_id', 'default')
+    user_message = data.get('message', '')
+    _touch_session(session_id)
+    
+    start_session_processing(session_id, user_message)
     
     # Return immediately with session info
     return jsonify({
@@ -451,8 +571,9 @@ def reset_session():
     data = request.get_json()
     session_id = data.get('session_id', 'default')
     
-    if session_id in sessions:
-        del sessions[session_id]
+    with session_store_lock:
+        sessions.pop(session_id, None)
+        active_sessions.pop(session_id, None)
     
     return jsonify({'status': 'success'})
 
@@ -461,40 +582,79 @@ def poll_queue():
     """Poll for new items in the response queue."""
     data = request.get_json()
     session_id = data.get('session_id', 'default')
+    _touch_session(session_id)
+    
+    with session_store_lock:
+        queue = response_queues.get(session_id)
     
-    if session_id not in response_queues:
+    if queue is None:
         return jsonify({'items': [], 'complete': True})
     
-    queue = response_queues[session_id]
     items = []
     complete = False
     
-    # Get up to 10 items from queue
-    for _ in range(10):
-        if queue:
-            item = queue.popleft()
-            if item['type'] == 'end':
-                complete = True
-                break
-            items.append(item)
-        else:
+    # Long-poll: block for the first item, then drain whatever else is ready
+    try:
+        item = queue.get(timeout=POLL_TIMEOUT_SECONDS)
+    except queue_module.Empty:
+        item = None
+    
+    while item is not None:
+        if item['type'] == 'end':
+            complete = True
+            break
+        items.append(item)
+        if item['type'] == 'error':
+            complete = True
             break
+        try:
+            item = queue.get_nowait()
+        except queue_module.Empty:
+            item = None
     
     return jsonify({
         'items': items,
         'complete': complete
     })
 
+@app.route('/stream', methods=['GET'])
+def stream_queue():
+    """Stream response queue items to the client as Server-Sent Events."""
+    session_id = request.args.get('session_id', 'default')
+    _touch_session(session_id)
+    queue = _get_response_queue(session_id)
+    
+    def generate():
+        while True:
+            try:
+                item = queue.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue_module.Empty:
+                # Keep the connection open through proxies
+                yield b": ping\n\n"
+                continue
+            
+            yield b"data: " + orjson.dumps(item) + b"\n\n"
+            if item['type'] in ('end', 'error'):
+                break
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/poll-alerts', methods=['POST'])
 def poll_alerts():
     """Poll for new alerts."""
     data = request.get_json()
     session_id = data.get('session_id', 'default')
+    _touch_session(session_id)
     
-    if session_id not in alert_queues:
+    with session_store_lock:
+        alert_queue = alert_queues.get(session_id)
+    
+    if alert_queue is None:
         return jsonify({'alerts': []})
     
-    alert_queue = alert_queues[session_id]
     alerts = []
     
     # Get all pending alerts
@@ -510,45 +670,37 @@ def receive_alert():
     alert_type = data.get('type')
     zone_id = data.get('zone')
     
-    # Get the most recent session or create a default one
-    session_id = most_recent_session if most_recent_session else 'default'
-    
-    # Initialize alert queue if needed
-    if session_id not in alert_queues:
-        alert_queues[session_id] = deque()
-    
-    # Add alert notification to alert queue for frontend to display immediately
-    alert_queues[session_id].append({
-        'type': alert_type,
-        'zone': zone_id,
-        'message': f"I see a {alert_type.replace('Emergency', ' emergency').lower()} in zone {zone_id}. I need to take action."
-    })
+    # Route to the target session, or else see _alert_session_ids
+    if data.get('session_id'):
+        session_ids = [data['session_id']]
+    else:
+        session_ids = _alert_session_ids()
     
     # Create alert message for the agent
     alert_message = f"<alert>{alert_type} in zone {zone_id}</alert>"
     
-    # Call our own chat endpoint to process the alert
-    chat_data = {
-        'session_id': session_id,
-        'message': alert_message
-    }
-    
-    # Make internal request to chat endpoint
     try:
-        import os
-        port = int(os.environ.get('PORT', 5001))
-        response = requests.post(f'https://agent-backend-880917788492.us-central1.run.app/chat', json=chat_data)
-        return jsonify({'status': 'success'})
+        for session_id in session_ids:
+            # Add alert notification to alert queue for frontend to display immediately
+            _get_alert_queue(session_id).append({
+                'type': alert_type,
+                'zone': zone_id,
+                'message': f"I see a {alert_type.replace('Emergency', ' emergency').lower()} in zone {zone_id}. I need to take action."
+            })
+            
+            # Process the alert in-process, the same way /chat does
+            start_session_processing(session_id, alert_message)
+        return jsonify({'status': 'success', 'sessions': session_ids})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 if __name__ == '__main__':
-    import os
-    port = int(os.environ.get('PORT', 5001))
+    # Development server only; production runs under gunicorn's gevent worker
+    # (see Dockerfile)
     print("\n" + "="*50)
     print("Project Drishti Conversation API")
     print("="*50)
-    print(f"Server starting on http://localhost:{port}")
+    print(f"Server starting on http://localhost:{PORT}")
     print("="*50 + "\n")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
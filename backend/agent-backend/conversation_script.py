@@ -4,9 +4,17 @@ Conversation script using Gemini with tool calling capabilities.
 Uses functions from tools.py for actual tool execution.
 """
 
+import asyncio
+import functools
+import inspect
+import orjson
 import sys
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from google.genai import types
-from gemini_helpers import call_google_llm_with_tools, parse_function_call, extract_text_response
+from gemini_helpers import aprewarm_gemini_client, call_google_llm_with_tools_stream, split_response
 from tools import (
     get_zone_summary,
     get_personnel_status,
@@ -18,7 +26,8 @@ from tools import (
     get_personnel_by_zone,
     list_gates_in_zone,
     evacuate_zone,
-    activate_crowd_control_protocol
+    activate_crowd_control_protocol,
+    get_active_alerts
 )
 
 # Tool mapping from function name to actual function
@@ -36,6 +45,23 @@ TOOL_FUNCTIONS = {
     "activate_crowd_control_protocol": activate_crowd_control_protocol
 }
 
+# Read-only tools whose results stay valid for the rest of a conversation. Only
+# static data belongs here: gate status, for one, also changes from simulator
+# events and other operators, which this conversation never hears about.
+CACHEABLE_TOOLS = frozenset({"list_all_zones", "get_map"})
+
+# Zone tools fetched speculatively for zones named in a message, while the model thinks
+PREFETCH_TOOLS = ("get_zone_summary", "list_gates_in_zone", "get_personnel_by_zone")
+
+# Most zones named in one message that are prefetched
+MAX_PREFETCH_ZONES = 2
+
+# Tool function and its accepted parameter names, resolved once at import
+_REGISTRY = {
+    name: (function, frozenset(inspect.signature(function).parameters))
+    for name, function in TOOL_FUNCTIONS.items()
+}
+
 def setup_tool_declarations():
     """Set up the function declarations for the tool calling API."""
     return [
@@ -209,33 +235,266 @@ def setup_tool_declarations():
         ),
     ]
 
-def execute_function_call(function_call):
-    """Execute a function call and return the result."""
-    function_name = function_call.name
+# Built once at import and shared by every conversation in the process
+TOOL_DECLARATIONS = setup_tool_declarations()
+SHARED_TOOL = types.Tool(function_declarations=TOOL_DECLARATIONS)
+
+# Persistent workers for tool calls (including prefetches); bounds how many run at once
+MAX_CONCURRENT_TOOLS = 8
+tool_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TOOLS, thread_name_prefix='tool-worker')
+
+# Seconds between checks of the backend for new alerts
+ALERT_POLL_SECONDS = 5
+
+# Sent back instead of re-running a round of calls identical to the previous one
+TOOL_LOOP_ERROR = "Tool loop detected: this exact call was just made with the same arguments. Use the earlier result or try a different approach."
+
+# Sentinel for a missing prefetched result (None is a valid tool result)
+_MISSING = object()
+
+_USER_ROLE = "user"
+_MODEL_ROLE = "model"
+
+def _user_msg(text):
+    """Build a user text message."""
+    return types.Content(role=_USER_ROLE, parts=[types.Part(text=text)])
+
+def _model_msg(text):
+    """Build a model text message."""
+    return types.Content(role=_MODEL_ROLE, parts=[types.Part(text=text)])
+
+# Messages kept in the rolling window re-sent to the model each turn
+HISTORY_WINDOW = 40
+
+# Longest summary of dropped tool results carried into the window
+MAX_SUMMARY_CHARS = 2000
+
+_SUMMARY_PREFIX = "[Prior tool results summary]: "
+
+def _is_user_text(content):
+    """Whether a message is a user turn (as opposed to a function response)."""
+    return content.role == _USER_ROLE and any(part.text for part in content.parts or [])
+
+def _summarize_tool_results(dropped):
+    """One-line summary of the function responses (and any earlier summary) in dropped messages."""
+    entries = []
+    for content in dropped:
+        for part in content.parts or []:
+            if part.function_response:
+                entries.append(f"{part.function_response.name}: {part.function_response.response}")
+            elif part.text and part.text.startswith(_SUMMARY_PREFIX):
+                entries.append(part.text[len(_SUMMARY_PREFIX):])
+    # Keep the most recent results when over budget
+    return "; ".join(entries)[-MAX_SUMMARY_CHARS:]
+
+def _trim_history(messages):
+    """Drop the oldest whole turns so at most HISTORY_WINDOW messages remain.
+
+    Cuts only at user text messages so function calls are never separated
+    from their function responses. Tool results from the dropped turns are
+    folded into a summary at the start of the first kept message.
+    """
+    excess = len(messages) - HISTORY_WINDOW
+    if excess <= 0:
+        return
     
-    # Parse arguments
-    args = {}
-    if hasattr(function_call, 'args') and function_call.args:
-        args = dict(function_call.args)
+    boundaries = [i for i, content in enumerate(messages) if _is_user_text(content)]
+    cut = next((i for i in boundaries if i >= excess), boundaries[-1] if boundaries else 0)
+    if cut == 0:
+        return
     
-    print(f"\n🔧 Executing tool: {function_name}")
-    print(f"   Arguments: {args}")
+    summary = _summarize_tool_results(messages[:cut])
+    del messages[:cut]
+    if summary:
+        first = messages[0]
+        messages[0] = types.Content(role=first.role, parts=[types.Part(text=_SUMMARY_PREFIX + summary), *first.parts])
+
+# Tools run on worker threads; keeps each call's log lines together on stdout
+_stdout_lock = threading.Lock()
+
+def _to_json_text(value):
+    """Render a tool argument or result as JSON text; strings are shown as-is."""
+    if isinstance(value, str):
+        return value
+    return orjson.dumps(value, default=str).decode()
+
+def _write_tool_log(function_name, args, outcome):
+    """Write the log lines for one tool call with a single write."""
+    with _stdout_lock:
+        sys.stdout.write(f"\n🔧 Executing tool: {function_name}\n   Arguments: {_to_json_text(args)}\n{outcome}\n")
+        sys.stdout.flush()
+
+def _cache_key(function_name, args):
+    """Key for a tool result in the tool cache and prefetch maps."""
+    return (function_name, tuple(sorted(args.items())))
+
+def execute_function_call(function_call, tool_cache=None, prefetched=None):
+    """Execute a function call and return the result.
+
+    tool_cache, when given, holds results of CACHEABLE_TOOLS for the current
+    conversation; prefetched holds speculative results for the current turn,
+    which the caller discards before running an action. Both are keyed by
+    tool name and arguments.
+    """
+    function_name = function_call.name
     
-    # Execute the function
-    if function_name in TOOL_FUNCTIONS:
-        try:
-            result = TOOL_FUNCTIONS[function_name](**args)
-            print(f"   Result: {result}")
-            return {"result": str(result)}
-        except Exception as e:
-            error_msg = f"Error executing {function_name}: {str(e)}"
-            print(f"   ❌ {error_msg}")
-            return {"error": error_msg}
-    else:
+    # FunctionCall.args is already a plain dict; use it without copying
+    args = function_call.args or {}
+    
+    entry = _REGISTRY.get(function_name)
+    if entry is None:
         error_msg = f"Unknown function: {function_name}"
-        print(f"   ❌ {error_msg}")
+        _write_tool_log(function_name, args, f"   ❌ {error_msg}")
         return {"error": error_msg}
     
+    tool_function, parameters = entry
+    # Ignore any argument the tool does not accept rather than failing the call
+    if not parameters.issuperset(args):
+        args = {name: value for name, value in args.items() if name in parameters}
+    
+    cache_key = None
+    if tool_cache is not None and function_name in CACHEABLE_TOOLS:
+        cache_key = _cache_key(function_name, args)
+        if cache_key in tool_cache:
+            result = tool_cache[cache_key]
+            _write_tool_log(function_name, args, f"   Result (cached): {_to_json_text(result)}")
+            return {"result": result}
+    
+    if prefetched and function_name in PREFETCH_TOOLS:
+        # Each speculative result is used at most once
+        result = prefetched.pop(_cache_key(function_name, args), _MISSING)
+        if result is not _MISSING:
+            _write_tool_log(function_name, args, f"   Result (prefetched): {_to_json_text(result)}")
+            return {"result": result}
+    
+    # Execute the function; results are returned as-is so the model gets structured data
+    try:
+        result = tool_function(**args)
+        _write_tool_log(function_name, args, f"   Result: {_to_json_text(result)}")
+        if cache_key is not None:
+            tool_cache[cache_key] = result
+        return {"result": result}
+    except Exception as e:
+        error_msg = f"Error executing {function_name}: {str(e)}"
+        _write_tool_log(function_name, args, f"   ❌ {error_msg}")
+        return {"error": error_msg}
+
+async def execute_function_calls(function_calls, tool_cache=None, prefetched=None):
+    """Execute function calls concurrently on the tool pool, returning results in call order."""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(tool_executor, execute_function_call, function_call, tool_cache, prefetched)
+        for function_call in function_calls
+    ))
+
+async def prefetch_zone_tools(text, tool_cache, prefetched):
+    """Speculatively run PREFETCH_TOOLS for zones named in text, storing results for this turn."""
+    loop = asyncio.get_running_loop()
+    
+    async def fetch(function_name, args):
+        try:
+            result = await loop.run_in_executor(tool_executor, functools.partial(_REGISTRY[function_name][0], **args))
+        except Exception:
+            # Speculative only; the model's own call will surface the error
+            return
+        if function_name in CACHEABLE_TOOLS:
+            tool_cache[_cache_key(function_name, args)] = result
+        else:
+            prefetched[_cache_key(function_name, args)] = result
+    
+    zones_key = _cache_key("list_all_zones", {})
+    if zones_key not in tool_cache:
+        await fetch("list_all_zones", {})
+    zone_ids = [zone_id for zone_id in tool_cache.get(zones_key, ()) if zone_id in text]
+    
+    await asyncio.gather(*(
+        fetch(function_name, {"zone_id": zone_id})
+        for zone_id in zone_ids[:MAX_PREFETCH_ZONES]
+        for function_name in PREFETCH_TOOLS
+        if _cache_key(function_name, {"zone_id": zone_id}) not in tool_cache
+    ))
+
+def _may_change_state(function_calls):
+    """Whether any call is outside the read-only tools that are cached or prefetched."""
+    return any(
+        function_call.name not in PREFETCH_TOOLS and function_call.name not in CACHEABLE_TOOLS
+        for function_call in function_calls
+    )
+
+async def discard_prefetch(prefetch_task, prefetched):
+    """Stop a turn's prefetch and drop its results before an action makes them stale.
+
+    Awaiting the cancelled task ensures no fetch still in flight stores a
+    pre-action result afterwards.
+    """
+    prefetch_task.cancel()
+    try:
+        await prefetch_task
+    except asyncio.CancelledError:
+        pass
+    prefetched.clear()
+
+async def stream_model_turn(messages, system_prompt):
+    """Stream one model turn, printing text as it arrives, and return it as a single response."""
+    parts = []
+    printed_text = False
+    
+    async for chunk in call_google_llm_with_tools_stream(
+        request_id=None,
+        model="gemini-2.5-flash",
+        messages=messages,
+        sp=system_prompt,
+        tools=[SHARED_TOOL],
+        user_id=None
+    ):
+        if not (chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts):
+            continue
+        
+        for part in chunk.candidates[0].content.parts:
+            if part.text and not part.thought:
+                if not printed_text:
+                    sys.stdout.write("\n🤖 Assistant: ")
+                    printed_text = True
+                sys.stdout.write(part.text)
+                sys.stdout.flush()
+            
+            # Merge streamed text fragments so history holds one part per run of text
+            if part.text and parts and parts[-1].text and not part.thought and not parts[-1].thought:
+                parts[-1] = types.Part(
+                    text=parts[-1].text + part.text,
+                    thought_signature=parts[-1].thought_signature or part.thought_signature
+                )
+            else:
+                parts.append(part)
+    
+    if printed_text:
+        sys.stdout.write("\n")
+    
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role=_MODEL_ROLE, parts=parts)
+    )])
+
+async def alert_poller(alert_queue):
+    """Put (zone_id, alert_type) on alert_queue whenever a new alert becomes active."""
+    seen = set()
+    while True:
+        try:
+            active_alerts = await asyncio.to_thread(get_active_alerts)
+        except Exception:
+            # Backend unreachable; try again on the next poll
+            active_alerts = None
+        
+        if active_alerts is not None:
+            current = {(zone_id, alert_type)
+                       for zone_id, alert_types in active_alerts.items()
+                       for alert_type in alert_types}
+            for alert in current - seen:
+                alert_queue.put_nowait(alert)
+            # Forget resolved alerts so they are reported again if they recur
+            seen = current
+        
+        await asyncio.sleep(ALERT_POLL_SECONDS)
+    
 def get_system_prompt():
     return """
 You are **Project Drishti**, an AI-powered situational awareness platform for large-scale event safety. Your primary mission is to act as a proactive central nervous system for the event's command center, providing actionable intelligence and executing commands to ensure attendee safety.
@@ -326,130 +585,150 @@ Your primary directive is to **maintain event safety and stability**.
     * **When to Use**: When detecting dangerous crowd density, stampede risks, or overcrowding alerts. This is a step below full evacuation.
 """
 
-def run_conversation():
-    """Run the interactive conversation with tool calling."""
-    # System prompt
-    system_prompt = get_system_prompt()
+# Built once at import and passed as the system instruction on every call
+SYSTEM_INSTRUCTION = types.Content(parts=[types.Part(text=get_system_prompt())])
 
-    # Setup tools
-    tools = types.Tool(function_declarations=setup_tool_declarations())
-    
+async def run_conversation():
+    """Run the interactive conversation with tool calling."""
     # Initialize conversation
     messages = []
     max_function_calls = 15
+    # Discovery results for this conversation; see CACHEABLE_TOOLS
+    tool_cache = {}
     
     print("🎭 Event Venue Management Assistant")
     print("Type 'exit' to quit\n")
     
+    # Watch the backend for new alerts while waiting on the commander
+    alert_queue = asyncio.Queue()
+    poller = asyncio.create_task(alert_poller(alert_queue))
+    # Open the Gemini connection while the commander types the first message
+    prewarm = asyncio.create_task(aprewarm_gemini_client())
+    input_task = None
+    
     while True:
-        # Get user input
-        user_input = input("\n👤 You: ").strip()
+        # Get user input without blocking the event loop, but handle any alert that arrives first
+        if input_task is None:
+            input_task = asyncio.create_task(asyncio.to_thread(input, "\n👤 You: "))
+        alert_task = asyncio.create_task(alert_queue.get())
+        done, _ = await asyncio.wait({input_task, alert_task}, return_when=asyncio.FIRST_COMPLETED)
         
-        if user_input.lower() in ['exit', 'quit', 'bye']:
-            print("\n👋 Goodbye!")
-            break
+        if alert_task in done:
+            zone_id, alert_type = alert_task.result()
+            print(f"\n🚨 Alert: {alert_type} in zone {zone_id}")
+            user_input = f"<alert>{alert_type} in zone {zone_id}</alert>"
+        else:
+            alert_task.cancel()
+            user_input = input_task.result().strip()
+            input_task = None
+            
+            if user_input.lower() in ['exit', 'quit', 'bye']:
+                poller.cancel()
+                print("\n👋 Goodbye!")
+                break
         
         # Add user message to conversation
-        messages.append(types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=user_input)]
-        ))
+        messages.append(_user_msg(user_input))
+        _trim_history(messages)
+        
+        # Fetch the likely discovery calls for any named zone while the model thinks
+        prefetched = {}
+        prefetch_task = asyncio.create_task(prefetch_zone_tools(user_input, tool_cache, prefetched))
         
         try:
             # Call LLM with tools
-            response = call_google_llm_with_tools(
-                request_id=None,
-                model="gemini-2.5-flash",
-                messages=messages,
-                sp=system_prompt,
-                tools=[tools],
-                user_id=None
-            )
+            response = await stream_model_turn(messages, SYSTEM_INSTRUCTION)
             
             # Process function calls in a loop
             function_call_count = 0
             final_response = None
+            # Calls made in the last few rounds, to catch the model repeating itself
+            recent_rounds = deque(maxlen=3)
+            tool_loop = False
             
             while function_call_count < max_function_calls:
-                has_function_call, function_call = parse_function_call(response)
+                # One pass over the parts for both the text and the function calls
+                text_response, function_calls = split_response(response)
                 
-                if has_function_call:
-                    # First, check if there's any text response to display before executing the function
-                    text_response = extract_text_response(response)
-                    if text_response:
-                        print(f"\n🤖 Assistant: {text_response}")
+                if function_calls:
+                    recent_rounds.append(tuple(_cache_key(function_call.name, function_call.args or {})
+                                               for function_call in function_calls))
+                    if len(recent_rounds) == 3 and recent_rounds[0] == recent_rounds[1] == recent_rounds[2]:
+                        # Still repeating after being told; stop instead of spending more round trips
+                        tool_loop = True
+                        break
                     
-                    function_call_count += 1
+                    function_call_count += len(function_calls)
                     
-                    # Add the assistant's response (including function call) to messages
+                    # Add the assistant's response (including function calls) to messages
                     if response.candidates and response.candidates[0].content:
                         messages.append(response.candidates[0].content)
                     
-                    # Execute function call
-                    function_result = execute_function_call(function_call)
-                    
-                    # Create function response and add to messages
-                    function_response_part = types.Part.from_function_response(
-                        name=function_call.name,
-                        response=function_result
-                    )
+                    if len(recent_rounds) >= 2 and recent_rounds[-1] == recent_rounds[-2]:
+                        # Same calls as last round; tell the model instead of re-running them
+                        print("\n⚠️  Repeated tool call detected")
+                        function_results = [{"error": TOOL_LOOP_ERROR}] * len(function_calls)
+                    else:
+                        if _may_change_state(function_calls):
+                            await discard_prefetch(prefetch_task, prefetched)
+                        # Execute all function calls from this response concurrently
+                        function_results = await execute_function_calls(function_calls, tool_cache, prefetched)
                     
+                    # Send every function response back in a single turn
                     messages.append(types.Content(
-                        role="user",
-                        parts=[function_response_part]
+                        role=_USER_ROLE,
+                        parts=[
+                            types.Part.from_function_response(
+                                name=function_call.name,
+                                response=function_result
+                            )
+                            for function_call, function_result in zip(function_calls, function_results)
+                        ]
                     ))
                     
                     # Get next response from LLM
-                    response = call_google_llm_with_tools(
-                        request_id=None,
-                        model="gemini-2.5-flash",
-                        messages=messages,
-                        sp=system_prompt,
-                        tools=[tools],
-                        user_id=None
-                    )
+                    response = await stream_model_turn(messages, SYSTEM_INSTRUCTION)
                     
                 else:
-                    # No more function calls - extract final text response
-                    final_response = extract_text_response(response)
-                    if not final_response:
-                        # Try fallback to response.text
-                        if hasattr(response, 'text') and response.text:
-                            final_response = response.text
-                        else:
-                            final_response = "I'm sorry, I couldn't process your request properly. Please try again."
+                    # No more function calls - the text is the final response
+                    final_response = text_response or "I'm sorry, I couldn't process your request properly. Please try again."
                     break
             
-            # Handle max function calls reached
-            if function_call_count >= max_function_calls:
-                print(f"\n⚠️  Maximum function calls ({max_function_calls}) reached")
+            # Handle a tool loop or max function calls reached
+            if tool_loop or function_call_count >= max_function_calls:
+                if tool_loop:
+                    print("\n⚠️  Tool loop detected, stopping")
+                else:
+                    print(f"\n⚠️  Maximum function calls ({max_function_calls}) reached")
                 final_response = "I'm having trouble completing your request."
-                # Extract any text from the last response
-                last_text = extract_text_response(response)
-                if last_text:
-                    final_response = last_text
-                elif hasattr(response, 'text') and response.text:
-                    final_response = response.text
+                # Use any text from the last response
+                text_response, _ = split_response(response)
+                if text_response:
+                    final_response = text_response
             
-            # Display final response
+            # Display final response unless it was already streamed
             if final_response:
-                print(f"\n🤖 Assistant: {final_response}")
+                if final_response != text_response:
+                    print(f"\n🤖 Assistant: {final_response}")
                 
                 # Add assistant's final response to messages
-                messages.append(types.Content(
-                    role="model",
-                    parts=[types.Part.from_text(text=final_response)]
-                ))
+                messages.append(_model_msg(final_response))
             
             print(f"\n[Completed with {function_call_count} function call(s)]")
                     
         except Exception as e:
             print(f"\n❌ Error: {str(e)}")
-            import traceback
             traceback.print_exc()
+        finally:
+            # Speculative results are only trusted within the turn they were fetched for
+            prefetch_task.cancel()
+        
+        # The commander's prompt is still waiting if this turn was an alert
+        if input_task is not None:
+            print("\n👤 You: ", end="", flush=True)
 
 if __name__ == "__main__":
     # No need to check for data.json anymore since we're using the backend API
     print("🚀 Connecting to backend API...")
     
-    run_conversation()
\ No newline at end of file
+    asyncio.run(run_conversation())
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+Database connection settings read from the environment.
+"""
+
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True, slots=True)
+class DBConfig:
+    """PostgreSQL connection parameters, resolved once and shared."""
+    
+    host: str
+    port: int
+    dbname: str
+    user: Optional[str]
+    password: Optional[str]
+    
+    @classmethod
+    def from_env(cls,
+                 dbname: str,
+                 user: Optional[str] = None,
+                 password: Optional[str] = None) -> 'DBConfig':
+        """Build from POSTGRES_* env vars, using the given defaults for unset ones."""
+        return cls(
+            host=os.environ.get('POSTGRES_HOST', 'localhost'),
+            port=int(os.environ.get('POSTGRES_PORT', 5432)),
+            dbname=os.environ.get('POSTGRES_DB', dbname),
+            user=os.environ.get('POSTGRES_USER', user),
+            password=os.environ.get('POSTGRES_PASSWORD', password)
+        )
+    
+    def params(self) -> Dict[str, Any]:
+        """Connection parameters as make_conninfo keyword arguments."""
+        return asdict(self)
@@ -1,27 +1,400 @@
-import psycopg2
-import json
+import orjson
+import psycopg
+from psycopg.types.json import Jsonb, set_json_dumps, set_json_loads
+import atexit
+import hashlib
+import logging
+import threading
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-import os
+from collections import deque
+from contextlib import nullcontext
+from functools import lru_cache
+from datetime import date, datetime, timezone
+from typing import Dict, List, Any, Optional, Union
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from db.config import DBConfig
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# jsonb parameters and results go through orjson instead of the stdlib json module
+set_json_dumps(orjson.dumps)
+set_json_loads(orjson.loads)
+
+# Calls that cannot conflict with the processed-once index are buffered and
+# written in batches with COPY; a batch is flushed when it reaches BATCH_SIZE
+# rows or FLUSH_INTERVAL_SECONDS elapse. A batch whose COPY fails goes back to
+# the front of the buffer for the next flush, and is dropped after
+# MAX_FLUSH_ATTEMPTS failures so a row that can never be written (say a NUL
+# byte in a prompt) does not block logging. If the database falls behind, the
+# buffer keeps at most MAX_PENDING rows and drops the rest.
+BATCH_SIZE = 100
+MAX_FLUSH_ATTEMPTS = 3
+FLUSH_INTERVAL_SECONDS = 1.0
+MAX_PENDING = 10_000
+
+# Columns query_logs may select; the large text bodies are left out unless
+# asked for, see get_log_full
+LOG_COLUMNS = (
+    'id', 'timestamp', 'user_id', 'conversation_date', 'model',
+    'system_prompt', 'user_prompt', 'llm_response', 'response_status',
+    'processing_time_ms', 'parsed_operations', 'operation_counts',
+    'error_message', 'session_id', 'input_tokens', 'output_tokens', 'finish_reason'
+)
+BODY_COLUMNS = frozenset({'system_prompt', 'user_prompt', 'llm_response'})
+SUMMARY_COLUMNS = tuple(c for c in LOG_COLUMNS if c not in BODY_COLUMNS)
+ISO_COLUMNS = frozenset({'timestamp', 'conversation_date'})
+
+# check_if_processed answers are reused for this long per (user_id, date)
+PROCESSED_CACHE_SIZE = 4096
+PROCESSED_CACHE_TTL_SECONDS = 60
+
+# Column order of the row tuples built by LLMCallLogger._row. The system
+# prompt is stored once in llm_prompts and referenced by its SHA-256 hash;
+# readers go through the llm_call_logs_full view.
+INSERT_COLUMNS = """
+    user_id, conversation_date, model, system_prompt_hash, user_prompt,
+    llm_response, response_status, processing_time_ms, parsed_operations,
+    operation_counts, error_message, session_id, input_tokens, output_tokens, finish_reason
+"""
+
+# Row insert; a dated success that is already recorded is skipped
+INSERT_SQL = f"""
+INSERT INTO llm_call_logs ({INSERT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (user_id, conversation_date) WHERE response_status = 'success' DO NOTHING;
+"""
+
+COPY_SQL = f"COPY llm_call_logs ({INSERT_COLUMNS}) FROM STDIN"
+
+# Logs are observability data: every write transaction commits without
+# waiting for the WAL flush. A crash can lose the last few hundred
+# milliseconds of logs but never corrupts or half-applies a transaction.
+ASYNC_COMMIT_SQL = "SET LOCAL synchronous_commit = off"
+
+PROMPT_UPSERT_SQL = """
+INSERT INTO llm_prompts (hash, body) VALUES (%s, %s)
+ON CONFLICT (hash) DO NOTHING;
+"""
+
+CHECK_PROCESSED_SQL = """
+SELECT EXISTS(
+    SELECT 1 FROM llm_call_logs 
+    WHERE user_id = %s 
+    AND conversation_date = %s
+    AND response_status = 'success'
+);
+"""
+
+SESSION_STATS_SQL = """
+SELECT 
+    COUNT(*) as total_calls,
+    COUNT(CASE WHEN response_status = 'success' THEN 1 END) as successful_calls,
+    COUNT(CASE WHEN response_status = 'error' THEN 1 END) as failed_calls,
+    AVG(processing_time_ms) as avg_processing_time_ms,
+    MIN(timestamp) as session_start,
+    MAX(timestamp) as session_end
+FROM llm_call_logs 
+WHERE session_id = %s;
+"""
+
+LOG_FULL_SQL = f"""
+SELECT {", ".join(LOG_COLUMNS)}
+FROM llm_call_logs_full
+WHERE id = %s;
+"""
+
+# Schema objects this module writes or reads through, each with the migration
+# in db/migrations that creates it; checked once when a logger is created
+SCHEMA_CHECK_SQL = """
+SELECT
+    EXISTS(
+        SELECT 1 FROM pg_index
+        WHERE indexrelid = to_regclass('llm_logs_processed_uk') AND indisvalid
+    ),
+    to_regclass('llm_prompts') IS NOT NULL,
+    EXISTS(
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'llm_call_logs' AND column_name = 'system_prompt_hash'
+    ),
+    to_regclass('llm_call_logs_full') IS NOT NULL;
+"""
+SCHEMA_CHECKS = (
+    ('valid index llm_logs_processed_uk', '001_llm_logs_processed_uk.sql'),
+    ('table llm_prompts', '003_llm_prompts.sql'),
+    ('column llm_call_logs.system_prompt_hash', '003_llm_prompts.sql'),
+    ('view llm_call_logs_full', '003_llm_prompts.sql'),
+)
+
+def _load_config() -> DBConfig:
+    """Connection settings for loggers created without a db_manager."""
+    return DBConfig.from_env(dbname='llm_logs', user='postgres', password='password')
+
+# Read once at import; the app loads .env before importing this module
+_CFG = _load_config()
+
+# Pool shared by loggers created without a db_manager
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+def _get_default_manager():
+    """Return the process-wide connection manager, creating it on first use."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            from db.trigger_manager import DatabaseConnectionManager
+            _default_manager = DatabaseConnectionManager(config=_CFG)
+        return _default_manager
+
+@lru_cache(maxsize=256)
+def _logs_sql(columns: tuple, by_user: bool, by_date_from: bool, by_date_to: bool, cursor_shape: int) -> str:
+    """SQL for one query_logs shape.
+    
+    Each combination of selected columns and filters maps to one stable
+    statement string, so the prepared-statement cache reuses it.
+    cursor_shape is 0 for the first page, 1 for a timestamp cursor and 2
+    for a (timestamp, id) cursor.
+    """
+    where_conditions = []
+    if by_user:
+        where_conditions.append("user_id = %s")
+    if by_date_from:
+        where_conditions.append("conversation_date >= %s")
+    if by_date_to:
+        where_conditions.append("conversation_date <= %s")
+    # Keyset pagination; rows written by one COPY batch share a
+    # timestamp, so id breaks ties
+    if cursor_shape == 2:
+        where_conditions.append("(timestamp, id) < (%s, %s)")
+    elif cursor_shape == 1:
+        where_conditions.append("timestamp < %s")
+    
+    where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+    
+    return f"""
+    SELECT {", ".join(columns)}
+    FROM llm_call_logs_full
+    {where_clause}
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s;
+    """
+
+class _RateLimiter:
+    """Allow at most max_per_window events per window_seconds, counting the rest."""
+    
+    def __init__(self, max_per_window: int = 5, window_seconds: float = 1.0):
+        self.max_per_window = max_per_window
+        self.window_seconds = window_seconds
+        self._window_start = 0.0
+        self._count = 0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+    
+    def allow(self) -> tuple:
+        """Returns (allowed, events suppressed since the last allowed one)."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window_seconds:
+                self._window_start = now
+                self._count = 0
+            if self._count < self.max_per_window:
+                self._count += 1
+                suppressed, self._suppressed = self._suppressed, 0
+                return True, suppressed
+            self._suppressed += 1
+            return False, 0
+
+# A database outage fails every logging call; tracebacks are rendered for at
+# most a handful of them per second so the outage does not turn into CPU load
+_error_limiter = _RateLimiter()
+
+def _log_failure(message: str, *args) -> None:
+    """logger.exception for the current exception, rate limited."""
+    allowed, suppressed = _error_limiter.allow()
+    if not allowed:
+        return
+    if suppressed:
+        message += " (%d similar errors suppressed)"
+        args += (suppressed,)
+    logger.exception(message, *args)
+
+def _pipeline(conn):
+    """Pipeline the statements of a block when libpq supports it."""
+    return conn.pipeline() if psycopg.Pipeline.is_supported() else nullcontext()
 
 class LLMCallLogger:
     """Logger for LLM API calls to PostgreSQL database."""
     
     def __init__(self, db_manager=None, session_id: Optional[str] = None):
-        self.db_manager = db_manager
-        self.db_params = {
-            'host': os.getenv('POSTGRES_HOST', 'localhost'),
-            'port': os.getenv('POSTGRES_PORT', '5432'),
-            'user': os.getenv('POSTGRES_USER', 'postgres'),
-            'password': os.getenv('POSTGRES_PASSWORD', 'password'),
-            'database': os.getenv('POSTGRES_DB', 'llm_logs')
-        }
         self.session_id = str(uuid.uuid4()) if not session_id else session_id
+        # Every operation goes through a pool; share a process-wide one if none was given
+        self.db_manager = db_manager or _get_default_manager()
         # print(f"LLM Logger initialized with session ID: {self.session_id}")
+        
+        # Rows waiting for the background COPY flusher
+        self._pending = deque(maxlen=MAX_PENDING)
+        self._dropped = 0
+        # Consecutive failed COPYs of the batch at the front of _pending
+        self._flush_failures = 0
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        
+        # (user_id, conversation_date) -> processed flag; TTLCache is not thread-safe
+        self._processed_cache = TTLCache(maxsize=PROCESSED_CACHE_SIZE, ttl=PROCESSED_CACHE_TTL_SECONDS)
+        self._processed_lock = threading.Lock()
+        
+        # Running totals for get_session_stats, updated as rows are written
+        self._stats = {
+            'total_calls': 0,
+            'successful_calls': 0,
+            'failed_calls': 0,
+            'timed_calls': 0,
+            'avg_processing_time_ms': 0.0,
+            'session_start': None,
+            'session_end': None
+        }
+        self._stats_lock = threading.Lock()
+        
+        # Prompt hashes known to be in llm_prompts, and bodies of those not yet
+        # written; a new prompt is upserted in the same transaction as the
+        # first row that references it
+        self._saved_prompts = set()
+        self._prompt_bodies = {}
+        self._prompt_lock = threading.Lock()
+        self.check_schema()
+        threading.Thread(target=self._flush_loop, name='llm-log-flusher', daemon=True).start()
+        atexit.register(self.flush)
+    
+    def check_schema(self) -> None:
+        """Raise RuntimeError if the migrations this logger relies on are missing.
+        
+        Without them every write and query would fail, and those failures are
+        only logged at a limited rate. An unreachable database is not treated
+        as missing schema; it is logged and the check is skipped.
+        """
+        try:
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(SCHEMA_CHECK_SQL)
+                present = cursor.fetchone()
+        except Exception:
+            _log_failure("LLM log schema check failed")
+            return
+        missing = [check for check, ok in zip(SCHEMA_CHECKS, present) if not ok]
+        if missing:
+            raise RuntimeError(
+                "LLM log schema is missing " +
+                ", ".join(f"{name} ({migration})" for name, migration in missing) +
+                "; apply db/migrations in order, see README"
+            )
+    
+    def _flush_loop(self):
+        """Background thread: write buffered rows on size or time threshold."""
+        while True:
+            self._wake.wait(FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            self.flush()
+    
+    def flush(self) -> int:
+        """Write all buffered rows with COPY; returns the number of rows written."""
+        written = 0
+        # One flusher at a time so batches keep their order
+        with self._flush_lock:
+            if self._dropped:
+                logger.warning("LLM log buffer full, dropped %d rows", self._dropped)
+                self._dropped = 0
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < BATCH_SIZE:
+                    batch.append(self._pending.popleft())
+                prompts = self._unsaved_prompts(batch)
+                try:
+                    with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                        with _pipeline(conn):
+                            cursor.execute(ASYNC_COMMIT_SQL)
+                            if prompts:
+                                cursor.executemany(PROMPT_UPSERT_SQL, prompts)
+                        with cursor.copy(COPY_SQL) as copy:
+                            for row in batch:
+                                copy.write_row(row)
+                    self._prompts_saved(prompts)
+                    written += len(batch)
+                except Exception:
+                    self._flush_failures += 1
+                    if self._flush_failures >= MAX_FLUSH_ATTEMPTS:
+                        _log_failure("LLM log COPY of %d rows failed %d times, dropping them",
+                                     len(batch), self._flush_failures)
+                        self._flush_failures = 0
+                        continue
+                    _log_failure("LLM log COPY of %d rows failed", len(batch))
+                    # Retry the batch first on the next flush; a full buffer
+                    # evicts rows from its newest end to make room
+                    self._dropped += max(0, len(self._pending) + len(batch) - MAX_PENDING)
+                    self._pending.extendleft(reversed(batch))
+                    break
+                self._flush_failures = 0
+                for row in batch:
+                    self._record_stats(row)
+        return written
+    
+    def _prompt_hash(self, system_prompt: Optional[str]) -> Optional[bytes]:
+        """Hash a system prompt, remembering its body until it is written."""
+        if system_prompt is None:
+            return None
+        prompt_hash = hashlib.sha256(system_prompt.encode()).digest()
+        with self._prompt_lock:
+            if prompt_hash not in self._saved_prompts:
+                self._prompt_bodies[prompt_hash] = system_prompt
+        return prompt_hash
+    
+    def _unsaved_prompts(self, rows: List[tuple]) -> List[tuple]:
+        """(hash, body) pairs for the rows' prompts not yet in llm_prompts."""
+        with self._prompt_lock:
+            return [
+                (prompt_hash, self._prompt_bodies[prompt_hash])
+                for prompt_hash in {row[3] for row in rows}
+                if prompt_hash in self._prompt_bodies
+            ]
+    
+    def _prompts_saved(self, prompts: List[tuple]) -> None:
+        """Record prompts whose upsert has been committed."""
+        with self._prompt_lock:
+            for prompt_hash, _ in prompts:
+                self._saved_prompts.add(prompt_hash)
+                self._prompt_bodies.pop(prompt_hash, None)
+    
+    def _row(self,
+             user_id: str,
+             conversation_date: str,
+             model: str,
+             system_prompt: str,
+             user_prompt: str,
+             llm_response: str,
+             response_status: str = 'success',
+             processing_time_ms: Optional[int] = None,
+             parsed_operations: Optional[List[Dict]] = None,
+             operation_counts: Optional[Dict] = None,
+             error_message: Optional[str] = None,
+             input_tokens: Optional[int] = None,
+             output_tokens: Optional[int] = None,
+             finish_reason: Optional[str] = None) -> tuple:
+        """Build an llm_call_logs row tuple in column order."""
+        return (
+            user_id,
+            date.fromisoformat(conversation_date) if conversation_date else None,
+            model,
+            self._prompt_hash(system_prompt),
+            user_prompt,
+            llm_response,
+            response_status,
+            processing_time_ms,
+            Jsonb(parsed_operations) if parsed_operations else None,
+            Jsonb(operation_counts) if operation_counts else None,
+            error_message,
+            self.session_id,
+            input_tokens,
+            output_tokens,
+            finish_reason
+        )
     
     def log_llm_call(self,
                      user_id: str,
@@ -38,130 +411,188 @@ class LLMCallLogger:
                      input_tokens: Optional[int] = None,
                      output_tokens: Optional[int] = None,
                      finish_reason: Optional[str] = None) -> bool:
-        """Log an LLM API call to the database."""
+        """Log an LLM API call to the database.
+        
+        Returns False if logging failed or a successful call is already
+        recorded for this user_id and conversation_date.
+        """
         
         try:
-            # Use database connection manager if available, otherwise fall back to direct connection
-            if self.db_manager:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    insert_sql = """
-                    INSERT INTO llm_call_logs (
-                        user_id, conversation_date, model, system_prompt, user_prompt,
-                        llm_response, response_status, processing_time_ms, parsed_operations,
-                        operation_counts, error_message, session_id, input_tokens, output_tokens, finish_reason
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id;
-                    """
-                    
-                    # Convert date string to date object
-                    conv_date = None
-                    if conversation_date:
-                        conv_date = datetime.strptime(conversation_date, '%Y-%m-%d').date()
-                    
-                    
-                    # Convert lists/dicts to JSON
-                    parsed_ops_json = json.dumps(parsed_operations) if parsed_operations else None
-                    op_counts_json = json.dumps(operation_counts) if operation_counts else None
-                    
-                    cursor.execute(insert_sql, (
-                        user_id,
-                        conv_date,
-                        model,
-                        system_prompt,
-                        user_prompt,
-                        llm_response,
-                        response_status,
-                        processing_time_ms,
-                        parsed_ops_json,
-                        op_counts_json,
-                        error_message,
-                        self.session_id,
-                        input_tokens,
-                        output_tokens,
-                        finish_reason
-                    ))
-                    
-                    log_id = cursor.fetchone()[0]
-                    conn.commit()
-                    cursor.close()
-                    
-                    # print(f"LLM call logged with ID: {log_id}")
-                    return True
-            else:
-                # Fall back to direct connection
-                conn = psycopg2.connect(**self.db_params)
-                cursor = conn.cursor()
-                
-                insert_sql = """
-                INSERT INTO llm_call_logs (
-                    user_id, conversation_date, model, system_prompt, user_prompt,
-                    llm_response, response_status, processing_time_ms, parsed_operations,
-                    operation_counts, error_message, session_id, input_tokens, output_tokens, finish_reason
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id;
-                """
-                
-                # Convert date string to date object
-                conv_date = datetime.strptime(conversation_date, '%Y-%m-%d').date()
-                
-                # Convert lists/dicts to JSON
-                parsed_ops_json = json.dumps(parsed_operations) if parsed_operations else None
-                op_counts_json = json.dumps(operation_counts) if operation_counts else None
-                
-                cursor.execute(insert_sql, (
-                    user_id,
-                    conv_date,
-                    model,
-                    system_prompt,
-                    str(user_prompt),
-                    llm_response,
-                    response_status,
-                    processing_time_ms,
-                    parsed_ops_json,
-                    op_counts_json,
-                    str(error_message),
-                    self.session_id,
-                    input_tokens,
-                    output_tokens,
-                    finish_reason
-                ))
-                
-                log_id = cursor.fetchone()[0]
-                conn.commit()
-                cursor.close()
-                conn.close()
-                
-                # print(f"LLM call logged with ID: {log_id}")
+            row = self._row(
+                user_id, conversation_date, model, system_prompt, user_prompt, llm_response,
+                response_status, processing_time_ms, parsed_operations, operation_counts,
+                error_message, input_tokens, output_tokens, finish_reason
+            )
+            if self._enqueue(row):
                 return True
             
-        except Exception as e:
-            import traceback
-            print(traceback.format_exc())
-            # print(f"Error logging LLM call: {e}")
+            prompts = self._unsaved_prompts([row])
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                with _pipeline(conn):
+                    cursor.execute(ASYNC_COMMIT_SQL)
+                    if prompts:
+                        cursor.executemany(PROMPT_UPSERT_SQL, prompts)
+                    cursor.execute(INSERT_SQL, row, prepare=True)
+                inserted = cursor.rowcount > 0
+            
+            # Committed by the pool when the block exits
+            self._prompts_saved(prompts)
+            return self._after_insert(row, inserted)
+            
+        except Exception:
+            _log_failure("LLM log insert failed")
             return False
     
-    def get_session_stats(self) -> Dict[str, Any]:
-        """Get statistics for the current session."""
+    async def alog_llm_call(self,
+                            user_id: str,
+                            conversation_date: str,
+                            model: str,
+                            system_prompt: str,
+                            user_prompt: str,
+                            llm_response: str,
+                            response_status: str = 'success',
+                            processing_time_ms: Optional[int] = None,
+                            parsed_operations: Optional[List[Dict]] = None,
+                            operation_counts: Optional[Dict] = None,
+                            error_message: Optional[str] = None,
+                            input_tokens: Optional[int] = None,
+                            output_tokens: Optional[int] = None,
+                            finish_reason: Optional[str] = None) -> bool:
+        """Async log_llm_call; inserts on the async pool without blocking the event loop."""
+        
         try:
-            conn = psycopg2.connect(**self.db_params)
-            cursor = conn.cursor()
+            row = self._row(
+                user_id, conversation_date, model, system_prompt, user_prompt, llm_response,
+                response_status, processing_time_ms, parsed_operations, operation_counts,
+                error_message, input_tokens, output_tokens, finish_reason
+            )
+            if self._enqueue(row):
+                return True
             
-            stats_sql = """
-            SELECT 
-                COUNT(*) as total_calls,
-                COUNT(CASE WHEN response_status = 'success' THEN 1 END) as successful_calls,
-                COUNT(CASE WHEN response_status = 'error' THEN 1 END) as failed_calls,
-                AVG(processing_time_ms) as avg_processing_time_ms,
-                MIN(timestamp) as session_start,
-                MAX(timestamp) as session_end
-            FROM llm_call_logs 
-            WHERE session_id = %s;
-            """
+            prompts = self._unsaved_prompts([row])
+            async with self.db_manager.aget_connection() as conn, conn.cursor() as cursor:
+                async with _pipeline(conn):
+                    await cursor.execute(ASYNC_COMMIT_SQL)
+                    if prompts:
+                        await cursor.executemany(PROMPT_UPSERT_SQL, prompts)
+                    await cursor.execute(INSERT_SQL, row, prepare=True)
+                inserted = cursor.rowcount > 0
             
-            cursor.execute(stats_sql, (self.session_id,))
-            result = cursor.fetchone()
+            self._prompts_saved(prompts)
+            return self._after_insert(row, inserted)
+            
+        except Exception:
+            _log_failure("LLM log insert failed")
+            return False
+    
+    def _enqueue(self, row: tuple) -> bool:
+        """Queue a row for the COPY flusher if it can take that path."""
+        # Only dated successes can hit the processed-once index, and their
+        # callers need to know whether the row was new; everything else is
+        # written behind by the batched COPY writer and is durable after the
+        # next flush
+        if row[6] == 'success' and row[1] is not None:
+            return False
+        if len(self._pending) == MAX_PENDING:
+            self._dropped += 1
+        self._pending.append(row)
+        if len(self._pending) >= BATCH_SIZE:
+            self._wake.set()
+        # Counted in the session totals once flush has written it
+        return True
+    
+    def _after_insert(self, row: tuple, inserted: bool) -> bool:
+        """Bookkeeping after a committed single-row insert; returns inserted."""
+        # Either way a successful call for this user/date is now on record
+        if row[6] == 'success':
+            self._mark_processed(row[0], row[1])
+        # No row back means this user/date already had a successful call
+        if inserted:
+            self._record_stats(row)
+        return inserted
+    
+    def _record_stats(self, row: tuple) -> None:
+        """Fold one written row into the session totals."""
+        now = datetime.now(timezone.utc)
+        processing_time_ms = row[7]
+        with self._stats_lock:
+            stats = self._stats
+            stats['total_calls'] += 1
+            if row[6] == 'success':
+                stats['successful_calls'] += 1
+            elif row[6] == 'error':
+                stats['failed_calls'] += 1
+            # Running mean (Welford) over calls that reported a time, like AVG()
+            if processing_time_ms is not None:
+                stats['timed_calls'] += 1
+                stats['avg_processing_time_ms'] += (processing_time_ms - stats['avg_processing_time_ms']) / stats['timed_calls']
+            if stats['session_start'] is None:
+                stats['session_start'] = now
+            stats['session_end'] = now
+    
+    def log_llm_calls_many(self, rows: List[Dict[str, Any]]) -> bool:
+        """Log several LLM calls at once.
+
+        Each row is a dict of log_llm_call keyword arguments. All inserts are
+        pipelined (sent back-to-back with a single sync) in one transaction;
+        rows for an already processed user_id and conversation_date are skipped.
+        """
+        if not rows:
+            return True
+        
+        try:
+            params = [self._row(**row) for row in rows]
+            prompts = self._unsaved_prompts(params)
+            
+            with self.db_manager.get_connection() as conn, conn.transaction(), conn.cursor() as cursor:
+                with _pipeline(conn):
+                    cursor.execute(ASYNC_COMMIT_SQL)
+                    if prompts:
+                        cursor.executemany(PROMPT_UPSERT_SQL, prompts)
+                    cursor.executemany(INSERT_SQL, params, returning=True)
+                # One result per row; rowcount 0 marks a skipped duplicate
+                inserted = []
+                while True:
+                    inserted.append(cursor.rowcount > 0)
+                    if not cursor.nextset():
+                        break
+            
+            self._prompts_saved(prompts)
+            for row, row_inserted in zip(params, inserted):
+                if row[6] == 'success' and row[1] is not None:
+                    self._mark_processed(row[0], row[1])
+                if row_inserted:
+                    self._record_stats(row)
+            return True
+            
+        except Exception:
+            _log_failure("LLM log insert failed")
+            return False
+    
+    def get_session_stats(self, refresh: bool = False) -> Dict[str, Any]:
+        """Get statistics for the current session.
+        
+        Served from this logger's running totals; refresh=True aggregates
+        llm_call_logs instead, which also counts rows other processes wrote
+        under the same session_id.
+        """
+        if not refresh:
+            with self._stats_lock:
+                stats = dict(self._stats)
+            return {
+                'session_id': self.session_id,
+                'total_calls': stats['total_calls'],
+                'successful_calls': stats['successful_calls'],
+                'failed_calls': stats['failed_calls'],
+                'avg_processing_time_ms': stats['avg_processing_time_ms'],
+                'session_start': stats['session_start'].isoformat() if stats['session_start'] else None,
+                'session_end': stats['session_end'].isoformat() if stats['session_end'] else None
+            }
+        
+        try:
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(SESSION_STATS_SQL, (self.session_id,))
+                result = cursor.fetchone()
             
             if result:
                 stats = {
@@ -184,145 +615,187 @@ class LLMCallLogger:
                     'session_end': None
                 }
             
-            cursor.close()
-            conn.close()
             return stats
             
         except Exception as e:
-            print(f"Error getting session stats: {e}")
+            _log_failure("Error getting session stats")
             return {'error': str(e)}
 
+    def _mark_processed(self, user_id: str, conv_date) -> None:
+        """Record a committed successful call in the check_if_processed cache."""
+        with self._processed_lock:
+            self._processed_cache[(user_id, conv_date)] = True
+    
     def check_if_processed(self, user_id: str, conversation_date: str) -> bool:
         """Check if a user_id and conversation_date combination has already been processed."""
         try:
-            # Use database connection manager if available
-            if self.db_manager:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Convert date string to date object
-                    conv_date = datetime.strptime(conversation_date, '%Y-%m-%d').date()
-                    
-                    check_sql = """
-                    SELECT EXISTS(
-                        SELECT 1 FROM llm_call_logs 
-                        WHERE user_id = %s 
-                        AND conversation_date = %s
-                        AND response_status = 'success'
-                    );
-                    """
-                    
-                    cursor.execute(check_sql, (user_id, conv_date))
-                    result = cursor.fetchone()[0]
-                    cursor.close()
-                    
-                    return result
-            else:
-                # Fall back to direct connection
-                conn = psycopg2.connect(**self.db_params)
-                cursor = conn.cursor()
-                
-                # Convert date string to date object
-                conv_date = datetime.strptime(conversation_date, '%Y-%m-%d').date()
-                
-                check_sql = """
-                SELECT EXISTS(
-                    SELECT 1 FROM llm_call_logs 
-                    WHERE user_id = %s 
-                    AND conversation_date = %s
-                    AND response_status = 'success'
-                );
-                """
-                
-                cursor.execute(check_sql, (user_id, conv_date))
+            # Convert date string to date object
+            conv_date = date.fromisoformat(conversation_date)
+            key = (user_id, conv_date)
+            
+            with self._processed_lock:
+                cached = self._processed_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(CHECK_PROCESSED_SQL, key, prepare=True)
                 result = cursor.fetchone()[0]
+            
+            # Errors below are not cached so the next call retries the query
+            with self._processed_lock:
+                self._processed_cache[key] = result
+            return result
                 
-                cursor.close()
-                conn.close()
-                
-                return result
-                
-        except Exception as e:
-            print(f"Error checking if processed: {e}")
+        except Exception:
+            _log_failure("Error checking if processed")
             # In case of error, return False to allow processing
             return False
     
+    async def acheck_if_processed(self, user_id: str, conversation_date: str) -> bool:
+        """Async check_if_processed, sharing its cache."""
+        try:
+            key = (user_id, date.fromisoformat(conversation_date))
+            
+            with self._processed_lock:
+                cached = self._processed_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            async with self.db_manager.aget_connection() as conn, conn.cursor() as cursor:
+                await cursor.execute(CHECK_PROCESSED_SQL, key, prepare=True)
+                result = (await cursor.fetchone())[0]
+            
+            with self._processed_lock:
+                self._processed_cache[key] = result
+            return result
+                
+        except Exception:
+            _log_failure("Error checking if processed")
+            return False
+    
+    
+    @staticmethod
+    def _format_log_entry(columns: List[str], row: tuple) -> Dict[str, Any]:
+        """Turn a result row into a dict with ISO-formatted timestamp and date."""
+        # jsonb columns already arrive decoded; only the temporal ones need work
+        return {
+            column: value.isoformat() if value is not None and column in ISO_COLUMNS else value
+            for column, value in zip(columns, row)
+        }
+    
+    @staticmethod
+    def _select_columns(columns: Optional[List[str]]) -> List[str]:
+        """Validate the requested query_logs columns against LOG_COLUMNS."""
+        columns = list(columns) if columns else list(SUMMARY_COLUMNS)
+        unknown = [c for c in columns if c not in LOG_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown llm_call_logs columns: {', '.join(unknown)}")
+        # The pagination cursor is always returned
+        return columns + [c for c in ('id', 'timestamp') if c not in columns]
+    
+    @staticmethod
+    def _build_logs_query(user_id: Optional[str],
+                          date_from: Optional[str],
+                          date_to: Optional[str],
+                          limit: int,
+                          columns: List[str],
+                          before_ts: Optional[Union[datetime, str]],
+                          before_id: Optional[str]) -> tuple:
+        """Bind the query_logs parameters to their cached statement; returns (sql, params)."""
+        params = []
+        if user_id:
+            params.append(user_id)
+        if date_from:
+            params.append(date.fromisoformat(date_from))
+        if date_to:
+            params.append(date.fromisoformat(date_to))
+        if before_ts:
+            params.append(before_ts)
+            if before_id:
+                params.append(before_id)
+        params.append(limit)
+        
+        cursor_shape = 0 if not before_ts else 2 if before_id else 1
+        query_sql = _logs_sql(tuple(columns), bool(user_id), bool(date_from), bool(date_to), cursor_shape)
+        return query_sql, params
     
     def query_logs(self, 
                    user_id: Optional[str] = None,
                    date_from: Optional[str] = None,
                    date_to: Optional[str] = None,
-                   limit: int = 100) -> List[Dict[str, Any]]:
-        """Query LLM call logs with optional filters."""
+                   limit: int = 100,
+                   columns: Optional[List[str]] = None,
+                   before_ts: Optional[Union[datetime, str]] = None,
+                   before_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Query LLM call logs with optional filters, newest first.
+        
+        Only SUMMARY_COLUMNS are returned unless columns names others from
+        LOG_COLUMNS; use get_log_full for a single call's prompt and response.
+        To fetch the next page, pass the last entry's timestamp and id as
+        before_ts and before_id.
+        """
+        columns = self._select_columns(columns)
         try:
-            conn = psycopg2.connect(**self.db_params)
-            cursor = conn.cursor()
-            
-            where_conditions = []
-            params = []
+            query_sql, params = self._build_logs_query(
+                user_id, date_from, date_to, limit, columns, before_ts, before_id
+            )
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(query_sql, params)
+                rows = cursor.fetchall()
             
-            if user_id:
-                where_conditions.append("user_id = %s")
-                params.append(user_id)
+            return [self._format_log_entry(columns, row) for row in rows]
             
-            if date_from:
-                where_conditions.append("conversation_date >= %s")
-                params.append(datetime.strptime(date_from, '%Y-%m-%d').date())
-            
-            if date_to:
-                where_conditions.append("conversation_date <= %s")
-                params.append(datetime.strptime(date_to, '%Y-%m-%d').date())
-            
-            where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-            
-            query_sql = f"""
-            SELECT
-                id, timestamp, user_id, conversation_date, model,
-                system_prompt, user_prompt, llm_response, response_status,
-                processing_time_ms, parsed_operations, operation_counts,
-                error_message, session_id, input_tokens, output_tokens, finish_reason
-            FROM llm_call_logs
-            {where_clause}
-            ORDER BY timestamp DESC
-            LIMIT %s;
-            """
-            
-            params.append(limit)
-            cursor.execute(query_sql, params)
+        except Exception:
+            _log_failure("Error querying logs")
+            return []
+    
+    async def aquery_logs(self, 
+                          user_id: Optional[str] = None,
+                          date_from: Optional[str] = None,
+                          date_to: Optional[str] = None,
+                          limit: int = 100,
+                          columns: Optional[List[str]] = None,
+                          before_ts: Optional[Union[datetime, str]] = None,
+                          before_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Async query_logs."""
+        columns = self._select_columns(columns)
+        try:
+            query_sql, params = self._build_logs_query(
+                user_id, date_from, date_to, limit, columns, before_ts, before_id
+            )
+            async with self.db_manager.aget_connection() as conn, conn.cursor() as cursor:
+                await cursor.execute(query_sql, params)
+                rows = await cursor.fetchall()
             
-            columns = [desc[0] for desc in cursor.description]
-            results = []
+            return [self._format_log_entry(columns, row) for row in rows]
             
-            for row in cursor.fetchall():
-                log_entry = dict(zip(columns, row))
-                # Convert timestamp to ISO string
-                if log_entry['timestamp']:
-                    log_entry['timestamp'] = log_entry['timestamp'].isoformat()
-                # Convert date to string
-                if log_entry['conversation_date']:
-                    log_entry['conversation_date'] = log_entry['conversation_date'].isoformat()
-                # Parse JSON fields
-                if log_entry['parsed_operations'] and isinstance(log_entry['parsed_operations'], str):
-                    log_entry['parsed_operations'] = json.loads(log_entry['parsed_operations'])
-                if log_entry['operation_counts'] and isinstance(log_entry['operation_counts'], str):
-                    log_entry['operation_counts'] = json.loads(log_entry['operation_counts'])
-                
-                results.append(log_entry)
+        except Exception:
+            _log_failure("Error querying logs")
+            return []
+    
+    def get_log_full(self, log_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch every column of one logged call, or None if it does not exist."""
+        try:
+            with self.db_manager.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(LOG_FULL_SQL, (log_id,))
+                row = cursor.fetchone()
             
-            cursor.close()
-            conn.close()
-            return results
+            return self._format_log_entry(LOG_COLUMNS, row) if row else None
             
-        except Exception as e:
-            print(f"Error querying logs: {e}")
-            return []
+        except Exception:
+            _log_failure("Error fetching log %s", log_id)
+            return None
 
 # Example usage and testing
 if __name__ == "__main__":
-    logger = LLMCallLogger()
+    # Run standalone, nothing has loaded .env yet
+    load_dotenv()
+    _CFG = _load_config()
+    call_logger = LLMCallLogger()
     
     # Test logging
-    test_success = logger.log_llm_call(
+    test_success = call_logger.log_llm_call(
         user_id="test_user_123",
         conversation_date="2025-06-04",
         model="gemini-2.5-flash",
@@ -339,11 +812,11 @@ if __name__ == "__main__":
         print("Test log entry created successfully!")
         
         # Get session stats
-        stats = logger.get_session_stats()
+        stats = call_logger.get_session_stats()
         print(f"Session stats: {stats}")
         
         # Query logs
-        logs = logger.query_logs(limit=5)
+        logs = call_logger.query_logs(limit=5)
         print(f"Found {len(logs)} log entries")
     else:
         print("Test log entry failed!")
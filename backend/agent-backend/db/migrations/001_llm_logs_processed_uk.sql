@@ -0,0 +1,42 @@
+-- At most one successful LLM call per (user_id, conversation_date).
+-- log_llm_call inserts with ON CONFLICT DO NOTHING against this index, so
+-- the insert itself doubles as the "already processed" check.
+-- CONCURRENTLY cannot run inside a transaction block; apply with
+-- `psql -f`, not `psql -1` or `psql -c`.
+-- Rows with a NULL conversation_date never conflict.
+-- The file is safe to rerun; if the index build fails (say a duplicate
+-- success row was logged while it ran), run it again.
+
+-- Older code never prevented duplicate dated successes. Keep the earliest
+-- row of each group as the success and mark the rest 'duplicate', so the
+-- unique build does not fail on them and no log row is deleted.
+UPDATE llm_call_logs l
+SET response_status = 'duplicate'
+FROM (
+    SELECT id, row_number() OVER (
+        PARTITION BY user_id, conversation_date
+        ORDER BY timestamp, id
+    ) AS n
+    FROM llm_call_logs
+    WHERE response_status = 'success' AND conversation_date IS NOT NULL
+) d
+WHERE l.id = d.id AND d.n > 1;
+
+-- A failed concurrent build leaves an INVALID index that IF NOT EXISTS would
+-- keep skipping, while ON CONFLICT cannot use it as an arbiter; drop it so
+-- the build below starts over.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = 'llm_logs_processed_uk' AND NOT i.indisvalid
+    ) THEN
+        DROP INDEX llm_logs_processed_uk;
+    END IF;
+END
+$$;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS llm_logs_processed_uk
+    ON llm_call_logs (user_id, conversation_date)
+    WHERE response_status = 'success';
@@ -0,0 +1,8 @@
+-- Indexes behind query_logs: newest-first listing with (timestamp, id)
+-- keyset pagination, optionally filtered by user, and date-range filters.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS llm_logs_ts_idx
+    ON llm_call_logs (timestamp DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS llm_logs_user_ts_idx
+    ON llm_call_logs (user_id, timestamp DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS llm_logs_date_idx
+    ON llm_call_logs (conversation_date);
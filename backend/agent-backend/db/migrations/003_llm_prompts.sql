@@ -0,0 +1,20 @@
+-- System prompts are stored once in llm_prompts, keyed by their SHA-256, and
+-- llm_call_logs rows carry only the hash. Rows logged before this migration
+-- keep their inline system_prompt; llm_call_logs_full resolves either form.
+CREATE TABLE IF NOT EXISTS llm_prompts (
+    hash bytea PRIMARY KEY,
+    body text NOT NULL
+);
+
+ALTER TABLE llm_call_logs ADD COLUMN IF NOT EXISTS system_prompt_hash bytea;
+ALTER TABLE llm_call_logs ALTER COLUMN system_prompt DROP NOT NULL;
+
+CREATE OR REPLACE VIEW llm_call_logs_full AS
+SELECT
+    l.id, l.timestamp, l.user_id, l.conversation_date, l.model,
+    COALESCE(p.body, l.system_prompt) AS system_prompt,
+    l.user_prompt, l.llm_response, l.response_status,
+    l.processing_time_ms, l.parsed_operations, l.operation_counts,
+    l.error_message, l.session_id, l.input_tokens, l.output_tokens, l.finish_reason
+FROM llm_call_logs l
+LEFT JOIN llm_prompts p ON p.hash = l.system_prompt_hash;
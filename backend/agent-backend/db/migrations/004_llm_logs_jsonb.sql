@@ -0,0 +1,16 @@
+-- parsed_operations and operation_counts must be jsonb so psycopg decodes
+-- them (with orjson) on fetch; convert them if an older schema made them text.
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'llm_call_logs' AND column_name = 'parsed_operations') <> 'jsonb' THEN
+        ALTER TABLE llm_call_logs
+            ALTER COLUMN parsed_operations TYPE jsonb USING parsed_operations::jsonb;
+    END IF;
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'llm_call_logs' AND column_name = 'operation_counts') <> 'jsonb' THEN
+        ALTER TABLE llm_call_logs
+            ALTER COLUMN operation_counts TYPE jsonb USING operation_counts::jsonb;
+    END IF;
+END
+$$;
@@ -5,65 +5,129 @@ This module provides PostgreSQL-based persistent storage for user triggers,
 replacing the in-memory UserTriggerManager with a database-backed implementation.
 """
 
-import os
+import asyncio
 import json
-import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extras import RealDictCursor
-from contextlib import contextmanager
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import logging
 import time
+from db.config import DBConfig
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Pool tuning shared by the sync and async pools: connections are recycled
+# after an hour (idle ones after ten minutes), and a borrower waits at most
+# POOL_TIMEOUT_SECONDS so pool starvation fails fast instead of hanging
+POOL_MAX_LIFETIME_SECONDS = 3600
+POOL_MAX_IDLE_SECONDS = 600
+POOL_TIMEOUT_SECONDS = 5.0
+
+# Connection settings used when a manager is created without a config
+DEFAULT_CONFIG = DBConfig.from_env(dbname='triggers')
+
 
 class DatabaseConnectionManager:
     """Manages PostgreSQL connection pool for parallel processing."""
     
-    def __init__(self, max_connections: int = 10):
+    def __init__(self, max_connections: int = 10, config: Optional[DBConfig] = None):
         """
         Initialize the connection pool.
         
         Args:
             max_connections: Maximum number of connections in the pool
+            config: Connection settings; DEFAULT_CONFIG if omitted
         """
-        self.pool = ThreadedConnectionPool(
-            minconn=1,
-            maxconn=max_connections,
-            host=os.environ.get('POSTGRES_HOST', 'localhost'),
-            port=int(os.environ.get('POSTGRES_PORT', 5432)),
-            database=os.environ.get('POSTGRES_DB', 'triggers'),
-            user=os.environ.get('POSTGRES_USER'),
-            password=os.environ.get('POSTGRES_PASSWORD')
+        self.conninfo = make_conninfo(**(config or DEFAULT_CONFIG).params())
+        self.max_connections = max_connections
+        # Statements run more than prepare_threshold times on a connection are
+        # prepared server-side, so repeated inserts/lookups skip parsing
+        # Connections are checked on checkout so one dropped by the server is
+        # replaced rather than handed out
+        self.pool = ConnectionPool(
+            self.conninfo,
+            min_size=1,
+            max_size=max_connections,
+            kwargs={'prepare_threshold': 5},
+            check=ConnectionPool.check_connection,
+            max_lifetime=POOL_MAX_LIFETIME_SECONDS,
+            max_idle=POOL_MAX_IDLE_SECONDS,
+            timeout=POOL_TIMEOUT_SECONDS,
+            open=True
         )
         logger.info(f"Database connection pool initialized with max {max_connections} connections")
+        
+        # Async pool for coroutine callers; it is tied to the event loop that
+        # opens it, so it is created on first use from inside that loop
+        self.apool = None
+        self._apool_lock = asyncio.Lock()
     
     @contextmanager
     def get_connection(self):
         """
         Context manager for database connections.
         
+        The transaction is committed when the block exits normally and rolled
+        back if it raises; the connection is always returned to the pool.
+        
+        Yields:
+            psycopg connection object
+        """
+        try:
+            with self.pool.connection() as conn:
+                yield conn
+        except Exception as e:
+            logger.error(f"Database connection error: {e}")
+            raise
+    
+    async def _get_apool(self) -> AsyncConnectionPool:
+        """Return the async pool, opening it on first use."""
+        async with self._apool_lock:
+            if self.apool is None:
+                apool = AsyncConnectionPool(
+                    self.conninfo,
+                    min_size=1,
+                    max_size=self.max_connections,
+                    kwargs={'prepare_threshold': 5},
+                    check=AsyncConnectionPool.check_connection,
+                    max_lifetime=POOL_MAX_LIFETIME_SECONDS,
+                    max_idle=POOL_MAX_IDLE_SECONDS,
+                    timeout=POOL_TIMEOUT_SECONDS,
+                    open=False
+                )
+                await apool.open()
+                self.apool = apool
+        return self.apool
+    
+    @asynccontextmanager
+    async def aget_connection(self):
+        """
+        Async context manager for database connections.
+        
+        Same commit/rollback semantics as get_connection.
+        
         Yields:
-            psycopg2 connection object
+            psycopg AsyncConnection object
         """
-        conn = None
+        apool = await self._get_apool()
         try:
-            # print(f"🔒 [{time.strftime('%H:%M:%S')}] Getting connection from pool (available: {self.pool.maxconn - len(self.pool._used)})")
-            conn = self.pool.getconn()
-            # print(f"🔒 [{time.strftime('%H:%M:%S')}] Got connection from pool (available: {self.pool.maxconn - len(self.pool._used)})")
-            yield conn
+            async with apool.connection() as conn:
+                yield conn
         except Exception as e:
             logger.error(f"Database connection error: {e}")
             raise
-        finally:
-            if conn:
-                # print(f"🔓 [{time.strftime('%H:%M:%S')}] Returning connection to pool")
-                self.pool.putconn(conn)
     
     def close_all(self):
         """Close all connections in the pool."""
-        self.pool.closeall()
+        self.pool.close()
         logger.info("All database connections closed")
+    
+    async def aclose_all(self):
+        """Close both pools; call from the loop that used the async pool."""
+        if self.apool is not None:
+            await self.apool.close()
+            self.apool = None
+        self.close_all()
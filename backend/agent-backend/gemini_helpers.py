@@ -1,11 +1,18 @@
+import asyncio
+import itertools
+import random
+import re
 import time
+import traceback
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from google.genai.types import HttpOptions
 import os
 from dotenv import load_dotenv
 import uuid
 from typing import Dict, Any, Optional
+from llm_cache import LLMCache, SemanticLLMCache
 
 # Load environment variables
 load_dotenv()
@@ -34,42 +41,312 @@ else:
 
 api_key = os.environ.get("GEMINI_API_KEY")
 
+# Rate limits are per key; GEMINI_API_KEYS (comma-separated) spreads calls over
+# several keys, otherwise the single GEMINI_API_KEY is used
+api_keys = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+if not api_keys and api_key:
+    api_keys = [api_key]
 
-if not api_key:
+if not api_keys:
     raise ValueError("GEMINI_API_KEY environment variable is required")
 
 GEMINI_TIMEOUT = 20 * 1000  # 20 seconds
-google_client = genai.Client(api_key=api_key, http_options=HttpOptions(timeout=GEMINI_TIMEOUT))
+
+# The client keeps one pooled httpx client per transport (sync and aio) for the
+# life of the process, so the TLS connection is reused across every call in a
+# function-calling loop; HTTP/2 multiplexes concurrent calls over it
+GEMINI_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.environ.get("GEMINI_MAX_CONNECTIONS", 64)),
+    max_keepalive_connections=int(os.environ.get("GEMINI_MAX_KEEPALIVE_CONNECTIONS", 32)),
+    keepalive_expiry=float(os.environ.get("GEMINI_KEEPALIVE_EXPIRY_SECONDS", 60))
+)
+GEMINI_CLIENT_ARGS = {'limits': GEMINI_POOL_LIMITS, 'http2': True}
+GEMINI_HTTP_OPTIONS = HttpOptions(
+    timeout=GEMINI_TIMEOUT,
+    client_args=GEMINI_CLIENT_ARGS,
+    async_client_args=GEMINI_CLIENT_ARGS
+)
+google_clients = [genai.Client(api_key=key, http_options=GEMINI_HTTP_OPTIONS) for key in api_keys]
+google_client = google_clients[0]
 model = "gemini-2.5-flash"
 
-def call_google_llm(model, messages, system_prompt, user_id=None, conversation_date=None, delay_seconds=0, response_format={"type": "text"}):
+# A key that hits a 429 is skipped for this long while another key is available
+RATE_LIMIT_COOLDOWN_SECONDS = 30
+_cooldown_until = [0.0] * len(google_clients)
+_client_turn = itertools.count()
+
+def _pick_client():
+    """Next client in round-robin order, skipping keys that are cooling down after a 429."""
+    start = next(_client_turn)
+    now = time.monotonic()
+    for offset in range(len(google_clients)):
+        index = (start + offset) % len(google_clients)
+        if _cooldown_until[index] <= now:
+            return google_clients[index]
+    # Every key is cooling down; use the one that recovers first
+    return google_clients[min(range(len(google_clients)), key=_cooldown_until.__getitem__)]
+
+def _cool_down(client):
+    """Route around client's key for RATE_LIMIT_COOLDOWN_SECONDS."""
+    _cooldown_until[google_clients.index(client)] = time.monotonic() + RATE_LIMIT_COOLDOWN_SECONDS
+
+def _client_available():
+    """True if some key is not cooling down."""
+    now = time.monotonic()
+    return any(until <= now for until in _cooldown_until)
+
+def prewarm_gemini_client():
+    """Open each sync client's connection ahead of the first user request."""
+    for client in google_clients:
+        try:
+            client.models.get(model=model)
+        except Exception as e:
+            print(f"Gemini pre-warm failed: {e}")
+
+async def aprewarm_gemini_client():
+    """Open each aio client's connection ahead of the first user request."""
+    for client in google_clients:
+        try:
+            await client.aio.models.get(model=model)
+        except Exception as e:
+            print(f"Gemini pre-warm failed: {e}")
+
+# Thinking tokens dominate latency on short answers, so budgets are kept small:
+# plain calls think a little, tool calls a little more since planning helps,
+# and simple lookups ("which gates ...", "list zones") skip thinking entirely
+DEFAULT_THINKING_BUDGET = 1024
+TOOL_THINKING_BUDGET = 2048
+_CHEAP_INTENT_RE = re.compile(r'^\s*(list|what|show|which)\b.*\b(zone|gate)s?\b', re.IGNORECASE)
+# Words that mark an action or a judgement call; a prompt containing one is
+# never treated as a cheap lookup
+_PLANNING_WORD_RE = re.compile(
+    r'\b(evacuat\w*|dispatch\w*|send|announc\w*|crowd control|fire|alert\w*|emergenc\w*|threat\w*'
+    r'|should|do|plan\w*|handle|respond|help)\b',
+    re.IGNORECASE
+)
+
+def _thinking_budget(messages, thinking_budget=None):
+    """thinking_budget if given, else 0 for a cheap single lookup and DEFAULT_THINKING_BUDGET otherwise."""
+    if thinking_budget is not None:
+        return thinking_budget
+    prompt = getattr(messages[0], 'text', None) if len(messages) == 1 else None
+    if prompt and _CHEAP_INTENT_RE.match(prompt) and not _PLANNING_WORD_RE.search(prompt):
+        return 0
+    return DEFAULT_THINKING_BUDGET
+
+# A turn whose latest user text is a read-only question ("which gates are open
+# in hall_2?", "how many people are in the lobby?") needs the model only to pick
+# a lookup tool and read back its result, so the whole tool loop for that turn
+# runs without thinking. Anything matching _PLANNING_WORD_RE keeps
+# TOOL_THINKING_BUDGET for planning.
+_LOOKUP_INTENT_RE = re.compile(r'^\s*(list|what|show|which|where|how many|is|are)\b', re.IGNORECASE)
+
+def _latest_user_text(messages):
+    """Text of the most recent user turn that carries text, skipping function responses."""
+    for message in reversed(messages):
+        if getattr(message, 'role', None) != 'user':
+            continue
+        text = " ".join(part.text for part in message.parts or () if part.text)
+        if text:
+            return text
+    return None
+
+def _tool_thinking_budget(messages, thinking_budget=None):
+    """thinking_budget if given, else 0 for a read-only lookup turn and TOOL_THINKING_BUDGET otherwise."""
+    if thinking_budget is not None:
+        return thinking_budget
+    prompt = _latest_user_text(messages)
+    if prompt and _LOOKUP_INTENT_RE.match(prompt) and not _PLANNING_WORD_RE.search(prompt):
+        return 0
+    return TOOL_THINKING_BUDGET
+
+# Running thought-token totals, for tuning the budgets above
+_thought_stats = {'calls': 0, 'thoughts_tokens': 0}
+
+def _record_thoughts(usage):
+    """Add one call's usage_metadata to the thought-token totals."""
+    _thought_stats['calls'] += 1
+    _thought_stats['thoughts_tokens'] += usage.thoughts_token_count or 0
+
+def thinking_stats():
+    """Number of calls seen and their mean thoughts_token_count."""
+    calls = _thought_stats['calls']
+    return {'calls': calls, 'mean_thoughts_tokens': _thought_stats['thoughts_tokens'] / calls if calls else 0.0}
+
+# call_google_llm runs at temperature 0, so identical requests get identical
+# answers; the tool-calling helpers sample at 0.2 and are not cached
+llm_cache = LLMCache()
+
+# Opt-in: paraphrased single-message prompts reuse a cached answer when their
+# embeddings are close enough (see SemanticLLMCache for the guards)
+USE_SEMANTIC_CACHE = os.environ.get("GEMINI_SEMANTIC_CACHE", "false").lower() == "true"
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_CONFIG = types.EmbedContentConfig(output_dimensionality=256)
+semantic_cache = SemanticLLMCache()
+
+def _semantic_prompt(messages):
+    """The prompt text if semantic caching applies to this request, else None."""
+    if not USE_SEMANTIC_CACHE or len(messages) != 1:
+        return None
+    return getattr(messages[0], 'text', None) or None
+
+def _embed(text):
+    """Embedding of text, or None if the embedding call fails."""
+    try:
+        result = _pick_client().models.embed_content(model=EMBEDDING_MODEL, contents=text, config=EMBEDDING_CONFIG)
+        return result.embeddings[0].values
+    except Exception as e:
+        print(f"Embedding failed, skipping semantic cache: {e}")
+        return None
+
+async def _aembed(text):
+    """Async _embed."""
+    try:
+        result = await _pick_client().aio.models.embed_content(model=EMBEDDING_MODEL, contents=text, config=EMBEDDING_CONFIG)
+        return result.embeddings[0].values
+    except Exception as e:
+        print(f"Embedding failed, skipping semantic cache: {e}")
+        return None
+
+# Caps concurrent async Gemini requests so asyncio.gather fan-out stays within RPM limits
+MAX_LLM_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 8))
+_llm_semaphore = asyncio.Semaphore(MAX_LLM_CONCURRENCY)
+
+# Strong references to fire-and-forget logging tasks until they finish
+_log_tasks = set()
+
+def _log_in_background(**log_kwargs):
+    """Schedule an async DB log write without waiting for it."""
+    task = asyncio.create_task(llm_logger.alog_llm_call(**log_kwargs))
+    _log_tasks.add(task)
+    task.add_done_callback(_log_tasks.discard)
+
+# Exponential backoff with full jitter: retry n sleeps uniform(0, min(cap, base * 2**n))
+RETRY_BASE_SECONDS = 1
+RETRY_CAP_SECONDS = 60
+RATE_LIMIT_RETRIES = 6
+
+def _is_rate_limited(error):
+    """True for a 429 / rate-limit error from the API."""
+    if isinstance(error, errors.APIError):
+        return error.code == 429
+    return "429" in str(error) or "rate limit" in str(error).lower()
+
+def _backoff_delay(attempt, error=None):
+    """Seconds to wait before retry number attempt (from 0), honoring Retry-After."""
+    delay = random.uniform(0, min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    retry_after = getattr(response, 'headers', {}).get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), RETRY_CAP_SECONDS))
+        except ValueError:
+            pass
+    return delay
+
+def _rate_limit_delay(client, attempt, error):
+    """Cool down client's key and return the wait before retrying, zero if another key is free."""
+    _cool_down(client)
+    delay = _backoff_delay(attempt, error) if not _client_available() else 0
+    print(f"🚨 Rate limit (429) encountered. Retrying in {delay:.1f}s...")
+    return delay
+
+def _retry_with_backoff(fn, attempts=RATE_LIMIT_RETRIES):
+    """Call fn(client), retrying rate-limited failures on another key or with jittered backoff."""
+    for attempt in range(attempts):
+        client = _pick_client()
+        try:
+            return fn(client)
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == attempts - 1:
+                raise
+            time.sleep(_rate_limit_delay(client, attempt, e))
+
+async def _aretry_with_backoff(fn, attempts=RATE_LIMIT_RETRIES):
+    """Async _retry_with_backoff; fn(client) returns a fresh awaitable per attempt."""
+    for attempt in range(attempts):
+        client = _pick_client()
+        try:
+            return await fn(client)
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == attempts - 1:
+                raise
+            await asyncio.sleep(_rate_limit_delay(client, attempt, e))
+
+async def _afirst_chunk(opening):
+    """Await a generate_content_stream call and its first chunk, returning (stream, chunk).
+
+    The request is only sent once the stream is iterated, so a retry around
+    the open alone would miss a 429; this makes the first chunk part of it.
+    chunk is None for an empty stream.
+    """
+    stream = await opening
+    try:
+        return stream, await anext(stream, None)
+    except BaseException:
+        await stream.aclose()
+        raise
+
+# Error rows keep only the head of the response; it is for diagnosis, not replay
+ERROR_RESPONSE_LOG_CHARS = 2000
+
+def _usage_stats(response):
+    """Return (input_tokens, output_tokens, finish_reason) for a response."""
+    input_tokens = 0
+    output_tokens = 0
+    finish_reason = None
+    
+    # Read the typed fields directly; to_json_dict() would serialize the whole candidate tree
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        input_tokens = usage.prompt_token_count or 0
+        output_tokens = (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)
+        _record_thoughts(usage)
+    
+    if hasattr(response, 'candidates') and response.candidates:
+        finish_reason = getattr(response.candidates[0], 'finish_reason', None)
+    
+    return input_tokens, output_tokens, str(finish_reason)[:50] if finish_reason else None
+
+def _text_config(system_prompt, thinking_budget):
+    """GenerateContentConfig for a deterministic plain-text call."""
+    return types.GenerateContentConfig(
+        temperature=0,
+        thinking_config=genai.types.ThinkingConfig(
+            thinking_budget=thinking_budget
+        ),
+        response_mime_type="text/plain",
+        system_instruction=[
+            types.Part.from_text(text=system_prompt)])
+
+def call_google_llm(model, messages, system_prompt, user_id=None, conversation_date=None, delay_seconds=0, response_format={"type": "text"}, thinking_budget=None):
     try:
         """Call Google LLM using the specified API format."""
         # Apply rate limiting
         
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0,
-            thinking_config=genai.types.ThinkingConfig(
-                thinking_budget=4096
-            ),
-            response_mime_type="text/plain",
-            system_instruction=[
-                types.Part.from_text(text=system_prompt)])
+        thinking_budget = _thinking_budget(messages, thinking_budget)
+        generate_content_config = _text_config(system_prompt, thinking_budget)
+        
+        cache_key = llm_cache.key(model, system_prompt, messages, thinking_budget=thinking_budget)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        semantic_prompt = _semantic_prompt(messages)
+        embedding = _embed(semantic_prompt) if semantic_prompt else None
+        if embedding:
+            semantic_scope = semantic_cache.scope(model, system_prompt, thinking_budget)
+            cached = semantic_cache.lookup(semantic_scope, semantic_prompt, embedding)
+            if cached is not None:
+                return cached
         
         # Record start time for API call timing
         start_time = time.time()
         
-        try:
-            response = google_client.models.generate_content(
-                model=model,
-                contents=messages,
-                config=generate_content_config)
-        except Exception as api_error:
-            # Handle 429 rate limit errors with 1-hour sleep
-            if "429" in str(api_error) or "rate limit" in str(api_error).lower():
-                print(f"🚨 Rate limit (429) encountered. Sleeping for 1 hour...")
-                time.sleep(3600)  # Sleep for 1 hour (3600 seconds)
-            raise api_error
+        response = _retry_with_backoff(lambda client: client.models.generate_content(
+            model=model,
+            contents=messages,
+            config=generate_content_config))
         
         # Calculate processing time in milliseconds
         processing_time_ms = int((time.time() - start_time) * 1000)
@@ -80,17 +357,7 @@ def call_google_llm(model, messages, system_prompt, user_id=None, conversation_d
         parsed_operations = None
         
         # Extract token counts and finish reason
-        input_tokens = 0
-        output_tokens = 0
-        finish_reason = None
-        
-        if hasattr(response, 'usage_metadata'):
-            usage_dict = response.to_json_dict().get('usage_metadata', {})
-            input_tokens = usage_dict.get('prompt_token_count', 0)
-            output_tokens = usage_dict.get('candidates_token_count', 0) + usage_dict.get('thoughts_token_count', 0)
-
-        if hasattr(response, 'candidates') and response.candidates:
-            finish_reason = getattr(response.candidates[0], 'finish_reason', None)
+        input_tokens, output_tokens, finish_reason = _usage_stats(response)
         
         # Log to database if enabled
         if USE_DB_LOGGING and llm_logger:
@@ -107,15 +374,159 @@ def call_google_llm(model, messages, system_prompt, user_id=None, conversation_d
                 operation_counts=None,
                 input_tokens=input_tokens,
                 output_tokens=output_tokens,
-                finish_reason=str(finish_reason)[:50] if finish_reason else None
+                finish_reason=finish_reason
             )
     
+        llm_cache.set(cache_key, response.text)
+        if embedding:
+            semantic_cache.add(semantic_scope, semantic_prompt, embedding, response.text)
         return response.text
     except Exception as e:
-        import traceback
         print(f"Error calling Google LLM: {e}", traceback.format_exc())
         return None
 
+async def acall_google_llm(model, messages, system_prompt, user_id=None, conversation_date=None, delay_seconds=0, response_format={"type": "text"}, thinking_budget=None):
+    """Async call_google_llm on the client's aio API; gather several for concurrent prompts."""
+    try:
+        thinking_budget = _thinking_budget(messages, thinking_budget)
+        generate_content_config = _text_config(system_prompt, thinking_budget)
+        
+        cache_key = llm_cache.key(model, system_prompt, messages, thinking_budget=thinking_budget)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        semantic_prompt = _semantic_prompt(messages)
+        embedding = await _aembed(semantic_prompt) if semantic_prompt else None
+        if embedding:
+            semantic_scope = semantic_cache.scope(model, system_prompt, thinking_budget)
+            cached = semantic_cache.lookup(semantic_scope, semantic_prompt, embedding)
+            if cached is not None:
+                return cached
+        
+        start_time = time.time()
+        
+        async def generate(client):
+            # The semaphore is not held while backing off
+            async with _llm_semaphore:
+                return await client.aio.models.generate_content(
+                    model=model,
+                    contents=messages,
+                    config=generate_content_config)
+        
+        response = await _aretry_with_backoff(generate)
+        
+        processing_time_ms = int((time.time() - start_time) * 1000)
+        print(f"Processing time: {processing_time_ms} ms")
+        
+        input_tokens, output_tokens, finish_reason = _usage_stats(response)
+        
+        # The DB write runs after the response is returned
+        if USE_DB_LOGGING and llm_logger:
+            _log_in_background(
+                user_id=user_id,
+                conversation_date=conversation_date,
+                model=model,
+                system_prompt=system_prompt,
+                user_prompt=messages[0].text if messages else "",
+                llm_response=response.text,
+                response_status='success',
+                processing_time_ms=processing_time_ms,
+                parsed_operations=None,
+                operation_counts=None,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                finish_reason=finish_reason
+            )
+        
+        llm_cache.set(cache_key, response.text)
+        if embedding:
+            semantic_cache.add(semantic_scope, semantic_prompt, embedding, response.text)
+        return response.text
+    except Exception as e:
+        print(f"Error calling Google LLM: {e}", traceback.format_exc())
+        return None
+
+async def stream_google_llm(model, messages, system_prompt, user_id=None, conversation_date=None, thinking_budget=None):
+    """Stream call_google_llm's answer, yielding text deltas as they arrive.
+
+    Completed answers share call_google_llm's cache, and a cached answer is
+    yielded as one delta. The semantic cache is skipped since its embedding
+    call would sit in front of the first token. Closing the generator early
+    closes the underlying stream so generation stops.
+    """
+    thinking_budget = _thinking_budget(messages, thinking_budget)
+    cache_key = llm_cache.key(model, system_prompt, messages, thinking_budget=thinking_budget)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+    
+    generate_content_config = _text_config(system_prompt, thinking_budget)
+    start_time = time.time()
+    stream = None
+    last_chunk = None
+    text_parts = []
+    
+    try:
+        stream, chunk = await _aretry_with_backoff(lambda client: _afirst_chunk(client.aio.models.generate_content_stream(
+            model=model,
+            contents=messages,
+            config=generate_content_config)))
+        while chunk is not None:
+            last_chunk = chunk
+            if chunk.text:
+                text_parts.append(chunk.text)
+                yield chunk.text
+            chunk = await anext(stream, None)
+    except Exception as e:
+        print(f"Error streaming Google LLM: {e}")
+        if USE_DB_LOGGING and llm_logger:
+            input_tokens, output_tokens, finish_reason = _usage_stats(last_chunk)
+            _log_in_background(
+                user_id=user_id,
+                conversation_date=conversation_date,
+                model=model,
+                system_prompt=system_prompt,
+                user_prompt=messages[0].text if messages else "",
+                llm_response="".join(text_parts)[:ERROR_RESPONSE_LOG_CHARS],
+                response_status='error',
+                processing_time_ms=int((time.time() - start_time) * 1000),
+                parsed_operations=None,
+                operation_counts=None,
+                error_message=str(e)[:500],
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                finish_reason=finish_reason
+            )
+        raise
+    finally:
+        if stream is not None:
+            await stream.aclose()
+    
+    processing_time_ms = int((time.time() - start_time) * 1000)
+    print(f"Processing time: {processing_time_ms} ms")
+    
+    text = "".join(text_parts)
+    input_tokens, output_tokens, finish_reason = _usage_stats(last_chunk)
+    if USE_DB_LOGGING and llm_logger:
+        _log_in_background(
+            user_id=user_id,
+            conversation_date=conversation_date,
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=messages[0].text if messages else "",
+            llm_response=text,
+            response_status='success',
+            processing_time_ms=processing_time_ms,
+            parsed_operations=None,
+            operation_counts=None,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            finish_reason=finish_reason
+        )
+    llm_cache.set(cache_key, text)
+
 def extract_text_response(response: Any) -> Optional[str]:
     """Extract text response from LLM response."""
     try:
@@ -123,13 +534,10 @@ def extract_text_response(response: Any) -> Optional[str]:
             response.candidates[0].content and 
             response.candidates[0].content.parts):
             
-            text_parts = []
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'text') and part.text:
-                    text_parts.append(part.text)
-            
-            if text_parts:
-                return " ".join(text_parts)
+            parts = response.candidates[0].content.parts
+            if len(parts) == 1:
+                return parts[0].text or None
+            return " ".join(part.text for part in parts if part.text) or None
         return None
     except Exception as e:
         # logger.error(f"Error extracting text response: {e}", send_on_slack=True)
@@ -143,22 +551,76 @@ def parse_function_call(response: Any) -> tuple[bool, Optional[Any]]:
             response.candidates[0].content and 
             response.candidates[0].content.parts):
             
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    return True, part.function_call
+            return next(((True, part.function_call) for part in response.candidates[0].content.parts
+                         if part.function_call), (False, None))
         return False, None
     except Exception as e:
         print(f"Error parsing function call: {e}")
         return False, None
+
+
+def parse_function_calls(response: Any) -> list:
+    """Parse all function calls from LLM response, in the order they were returned."""
+    try:
+        if (response.candidates and 
+            response.candidates[0].content and 
+            response.candidates[0].content.parts):
+            
+            return [part.function_call for part in response.candidates[0].content.parts
+                    if getattr(part, 'function_call', None)]
+        return []
+    except Exception as e:
+        print(f"Error parsing function calls: {e}")
+        return []
+
+
+def split_response(response: Any) -> tuple[Optional[str], list]:
+    """Split an LLM response into its text and function calls in a single pass over the parts."""
+    text_parts = []
+    function_calls = []
+    try:
+        if (response.candidates and 
+            response.candidates[0].content and 
+            response.candidates[0].content.parts):
+            
+            for part in response.candidates[0].content.parts:
+                if part.function_call:
+                    function_calls.append(part.function_call)
+                elif part.text:
+                    text_parts.append(part.text)
+    except Exception as e:
+        print(f"Error splitting response: {e}")
+    
+    return (" ".join(text_parts) if text_parts else None), function_calls
     
 
-def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user_id=None, max_retries=3):
-    """Call Google LLM with optional tools and return full response object (for tool calling)"""
+# Validated tool-calling configs, keyed by system prompt and tool object identity
+_tool_config_cache = {}
+TOOL_CONFIG_CACHE_SIZE = 32
+
+def _system_prompt_text(sp):
+    """Plain text of a system prompt given as a string or a prebuilt Content."""
+    if isinstance(sp, str):
+        return sp
+    return "".join(part.text or "" for part in sp.parts or [])
+
+def _get_tool_config(sp, tools=None, thinking_budget=TOOL_THINKING_BUDGET):
+    """Return a GenerateContentConfig for the prompt, tools and budget, building it only once.
+
+    sp may be a string or a prebuilt types.Content, which is used as-is.
+    """
+    # Content objects are unhashable, so they are keyed by identity
+    sp_key = sp if isinstance(sp, str) else id(sp)
+    key = (sp_key, tuple(id(tool) for tool in tools) if tools else (), thinking_budget)
+    cached = _tool_config_cache.get(key)
+    if cached is not None:
+        return cached[2]
+    
     config_params = {
         'temperature': 0.2,
-        'thinking_config': genai.types.ThinkingConfig(thinking_budget=4096),
+        'thinking_config': genai.types.ThinkingConfig(thinking_budget=thinking_budget),
         'response_mime_type': "text/plain",
-        'system_instruction': [types.Part.from_text(text=sp)]
+        'system_instruction': [types.Part.from_text(text=sp)] if isinstance(sp, str) else sp
     }
     
     if tools:
@@ -166,12 +628,24 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
     
     generate_content_config = types.GenerateContentConfig(**config_params)
     
+    if len(_tool_config_cache) >= TOOL_CONFIG_CACHE_SIZE:
+        _tool_config_cache.clear()
+    # Keep references to the prompt and tools so their ids stay valid while cached
+    _tool_config_cache[key] = (sp, tuple(tools) if tools else (), generate_content_config)
+    return generate_content_config
+
+def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user_id=None, max_retries=3, thinking_budget=None):
+    """Call Google LLM with optional tools and return full response object (for tool calling)"""
+    generate_content_config = _get_tool_config(sp, tools, _tool_thinking_budget(messages, thinking_budget))
+    
     for attempt in range(max_retries):
+        response = None
+        input_tokens = output_tokens = finish_reason = None
         try:
             # logger.info(f"[DEBUG] GEMINI API CALL WITH TOOLS - Request ID: {request_id}, Attempt: {attempt + 1}")
             start_time = time.time()
-            response = None
-            response = google_client.models.generate_content(
+            client = _pick_client()
+            response = client.models.generate_content(
                 model=model,
                 contents=messages,
                 config=generate_content_config
@@ -183,18 +657,12 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
                 # logger.warning(f"Empty response from LLM (attempt {attempt + 1}/{max_retries})")
                 if attempt < max_retries - 1:
                     # logger.info(f"Retrying in {2 ** attempt} seconds...")
-                    time.sleep(2 ** attempt)
+                    time.sleep(_backoff_delay(attempt))
                     continue
                 else:
                     raise Exception("Failed to get response from LLM after all retries")
 
-            if hasattr(response, 'usage_metadata'):
-                usage_dict = response.to_json_dict().get('usage_metadata', {})
-                input_tokens = usage_dict.get('prompt_token_count', 0)
-                output_tokens = usage_dict.get('candidates_token_count', 0) + usage_dict.get('thoughts_token_count', 0)
-
-            if hasattr(response, 'candidates') and response.candidates:
-                finish_reason = getattr(response.candidates[0], 'finish_reason', None)
+            input_tokens, output_tokens, finish_reason = _usage_stats(response)
             
             # Log successful response
             # logger.info(f"LLM call successful on attempt {attempt + 1}")
@@ -205,7 +673,7 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
                     user_id=user_id,
                     conversation_date=None,
                     model=model,
-                    system_prompt=sp,
+                    system_prompt=_system_prompt_text(sp),
                     user_prompt=str(messages),
                     llm_response=str(response),
                     response_status='success',
@@ -214,7 +682,7 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
                     operation_counts=None,
                     input_tokens=input_tokens,
                     output_tokens=output_tokens,
-                    finish_reason=str(finish_reason)[:50] if finish_reason else None
+                    finish_reason=finish_reason
                 )
             return response
             
@@ -225,9 +693,9 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
                     user_id=user_id,
                     conversation_date=None,
                     model=model,
-                    system_prompt=sp,
+                    system_prompt=_system_prompt_text(sp),
                     user_prompt=str(messages),
-                    llm_response=str(response),
+                    llm_response=str(response)[:ERROR_RESPONSE_LOG_CHARS],
                     response_status='error',
                     processing_time_ms=0,
                     parsed_operations=0,
@@ -235,19 +703,170 @@ def call_google_llm_with_tools(request_id, model, messages, sp, tools=None, user
                     error_message=str(e)[:500],
                     input_tokens=input_tokens,
                     output_tokens=output_tokens,
-                    finish_reason=str(finish_reason)[:50] if finish_reason else None
+                    finish_reason=finish_reason
                 )
             # logger.error(f"API call failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
                 # logger.info("Retrying...")
-                time.sleep(1)
+                time.sleep(_rate_limit_delay(client, attempt, e) if _is_rate_limited(e) else _backoff_delay(attempt, e))
             else:
                 # logger.error("All attempts failed. Giving up.", send_on_slack=True)
                 raise
     
     # This should never be reached due to the raise in the loop
     raise Exception("Unexpected error in call_google_llm_with_tools")
+
+async def acall_google_llm_with_tools(request_id, model, messages, sp, tools=None, user_id=None, max_retries=3, thinking_budget=None):
+    """Async call_google_llm_with_tools on the client's aio API, with the same retries."""
+    generate_content_config = _get_tool_config(sp, tools, _tool_thinking_budget(messages, thinking_budget))
     
+    for attempt in range(max_retries):
+        response = None
+        input_tokens = output_tokens = finish_reason = None
+        try:
+            start_time = time.time()
+            client = _pick_client()
+            async with _llm_semaphore:
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=messages,
+                    config=generate_content_config
+                )
+            processing_time_ms = int((time.time() - start_time) * 1000)
+            print(f"Processing time: {processing_time_ms} ms")
+            
+            if response is None or response.candidates[0].content.parts is None:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(_backoff_delay(attempt))
+                    continue
+                else:
+                    raise Exception("Failed to get response from LLM after all retries")
+            
+            input_tokens, output_tokens, finish_reason = _usage_stats(response)
+            
+            if USE_DB_LOGGING and llm_logger:
+                _log_in_background(
+                    user_id=user_id,
+                    conversation_date=None,
+                    model=model,
+                    system_prompt=_system_prompt_text(sp),
+                    user_prompt=str(messages),
+                    llm_response=str(response),
+                    response_status='success',
+                    processing_time_ms=0,
+                    parsed_operations=0,
+                    operation_counts=None,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    finish_reason=finish_reason
+                )
+            return response
+            
+        except Exception as e:
+            print('somethin went wrong', e)
+            if USE_DB_LOGGING and llm_logger:
+                _log_in_background(
+                    user_id=user_id,
+                    conversation_date=None,
+                    model=model,
+                    system_prompt=_system_prompt_text(sp),
+                    user_prompt=str(messages),
+                    llm_response=str(response)[:ERROR_RESPONSE_LOG_CHARS],
+                    response_status='error',
+                    processing_time_ms=0,
+                    parsed_operations=0,
+                    operation_counts=None,
+                    error_message=str(e)[:500],
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    finish_reason=finish_reason
+                )
+            if attempt < max_retries - 1:
+                await asyncio.sleep(_rate_limit_delay(client, attempt, e) if _is_rate_limited(e) else _backoff_delay(attempt, e))
+            else:
+                raise
+    
+    raise Exception("Unexpected error in acall_google_llm_with_tools")
+    
+async def call_google_llm_with_tools_stream(request_id, model, messages, sp, tools=None, user_id=None, max_retries=3, thinking_budget=None):
+    """Stream an LLM response with optional tools, yielding each chunk as it arrives.
+
+    Failures before the first chunk is yielded are retried like
+    acall_google_llm_with_tools, on another key after a 429. Once output has
+    reached the caller an error is raised, since a retry would repeat it.
+    """
+    generate_content_config = _get_tool_config(sp, tools, _tool_thinking_budget(messages, thinking_budget))
+    
+    for attempt in range(max_retries):
+        start_time = time.time()
+        chunks = []
+        input_tokens = output_tokens = None
+        finish_reason = None
+        usage = None
+        client = _pick_client()
+        
+        try:
+            stream = await client.aio.models.generate_content_stream(
+                model=model,
+                contents=messages,
+                config=generate_content_config
+            )
+            async for chunk in stream:
+                chunks.append(chunk)
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                    input_tokens = chunk.usage_metadata.prompt_token_count or 0
+                    output_tokens = (chunk.usage_metadata.candidates_token_count or 0) + (chunk.usage_metadata.thoughts_token_count or 0)
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = chunk.candidates[0].finish_reason
+                yield chunk
+            break
+        except Exception as e:
+            print('somethin went wrong', e)
+            if USE_DB_LOGGING and llm_logger:
+                _log_in_background(
+                    user_id=user_id,
+                    conversation_date=None,
+                    model=model,
+                    system_prompt=_system_prompt_text(sp),
+                    user_prompt=str(messages),
+                    llm_response=str(chunks)[:ERROR_RESPONSE_LOG_CHARS],
+                    response_status='error',
+                    processing_time_ms=0,
+                    parsed_operations=0,
+                    operation_counts=None,
+                    error_message=str(e)[:500],
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    finish_reason=str(finish_reason)[:50] if finish_reason else None
+                )
+            if chunks or attempt == max_retries - 1:
+                raise
+            await asyncio.sleep(_rate_limit_delay(client, attempt, e) if _is_rate_limited(e) else _backoff_delay(attempt, e))
+    
+    if usage:
+        _record_thoughts(usage)
+    
+    processing_time_ms = int((time.time() - start_time) * 1000)
+    print(f"Processing time: {processing_time_ms} ms")
+    
+    if USE_DB_LOGGING and llm_logger:
+        _log_in_background(
+            user_id=user_id,
+            conversation_date=None,
+            model=model,
+            system_prompt=_system_prompt_text(sp),
+            user_prompt=str(messages),
+            llm_response=str(chunks),
+            response_status='success',
+            processing_time_ms=0,
+            parsed_operations=0,
+            operation_counts=None,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            finish_reason=str(finish_reason)[:50] if finish_reason else None
+        )
+
 if __name__ == "__main__":
     def _setup_tool_declarations():
         """Set up the function declarations for the tool calling API."""
@@ -375,24 +994,25 @@ if __name__ == "__main__":
     tools = types.Tool(function_declarations=_setup_tool_declarations())
     tools = [tools]
     # print(tools)
-    # response = call_google_llm(
-    #         model, 
-    #         [types.Part.from_text(text='what clinics you ahve')], 
-    #         system_prompt='you are bot', 
-    #         conversation_date='2025-07-17',
-    #     )
-    # response = call_google_llm(
-    #         model, 
-    #         [types.Part.from_text(text='what clinics you ahve')], 
-    #         system_prompt='you are bot', 
-    #         conversation_date='2025-07-17',
-    #     )
-    response = call_google_llm_with_tools(
-        request_id=None,
-        model=model,
-        messages=[types.Part.from_text(text='what clinics you ahve')],
-        sp='you are bot',
-        tools=tools,
-        user_id=None
-    )
-    print(response)
\ No newline at end of file
+    
+    async def _main():
+        # Both requests are in flight at once
+        return await asyncio.gather(
+            acall_google_llm(
+                model,
+                [types.Part.from_text(text='what clinics you ahve')],
+                system_prompt='you are bot',
+                conversation_date='2025-07-17',
+            ),
+            acall_google_llm_with_tools(
+                request_id=None,
+                model=model,
+                messages=[types.Part.from_text(text='what clinics you ahve')],
+                sp='you are bot',
+                tools=tools,
+                user_id=None
+            ),
+        )
+    
+    for response in asyncio.run(_main()):
+        print(response)
\ No newline at end of file
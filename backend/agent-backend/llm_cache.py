@@ -0,0 +1,139 @@
+"""
+In-process caches for deterministic (temperature 0) LLM responses.
+"""
+
+import hashlib
+import math
+import operator
+import re
+import threading
+from collections import deque
+from typing import Any, List, Optional, Sequence
+
+import orjson
+from cachetools import TTLCache
+
+LLM_CACHE_SIZE = 10_000
+LLM_CACHE_TTL_SECONDS = 3600
+
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_SIMILARITY_THRESHOLD = 0.92
+
+# Identifiers (zone/gate/unit IDs like hall_1_lower), numbers and dates;
+# prompts differing in any of these are never treated as paraphrases
+_CRITICAL_TOKEN_RE = re.compile(r'\b\w*\d[\w-]*\b|\b\w+_\w+\b')
+
+
+def _message_key(message: Any) -> Any:
+    """JSON-serializable form of a message given as a str or a genai type."""
+    if isinstance(message, str):
+        return message
+    return message.model_dump(mode='json', exclude_none=True)
+
+
+class LLMCache:
+    """Exact-match response cache keyed by model, system prompt, messages and tools."""
+    
+    def __init__(self, maxsize: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # TTLCache is not thread-safe
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(model: str, system_prompt: str, messages: list, tool_names: tuple = (),
+            thinking_budget: Optional[int] = None) -> str:
+        """Stable digest of everything that determines a temperature-0 response."""
+        payload = {
+            'model': model,
+            'sp': system_prompt,
+            'msgs': [_message_key(message) for message in messages],
+            'tools': list(tool_names),
+            'thinking': thinking_budget
+        }
+        return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Cached response for key, or None."""
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+    
+    def set(self, key: str, value: Any) -> None:
+        """Store a response; None is never cached."""
+        if value is None:
+            return
+        with self._lock:
+            self._cache[key] = value
+    
+    def stats(self) -> dict:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+class SemanticLLMCache:
+    """Near-duplicate prompt cache over normalized embeddings.
+    
+    Entries are scanned linearly by cosine similarity, which is cheap at
+    this size next to an LLM round trip. A hit also needs the same scope
+    (model and system prompt) and the same critical tokens as the prompt.
+    """
+    
+    def __init__(self, maxsize: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        # (scope, unit embedding, critical tokens, response); oldest evicted first
+        self._entries = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def scope(model: str, system_prompt: str, thinking_budget: Optional[int] = None) -> str:
+        """Key for the part of the request that must match exactly."""
+        return hashlib.sha256(f"{model}\0{thinking_budget}\0{system_prompt}".encode()).hexdigest()
+    
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+        return [x / norm for x in embedding]
+    
+    @staticmethod
+    def _critical_tokens(prompt: str) -> frozenset:
+        return frozenset(token.lower() for token in _CRITICAL_TOKEN_RE.findall(prompt))
+    
+    def lookup(self, scope: str, prompt: str, embedding: Sequence[float]) -> Optional[Any]:
+        """Cached response for the most similar prompt above the threshold, or None."""
+        query = self._normalize(embedding)
+        tokens = self._critical_tokens(prompt)
+        best_score, best_response = self.threshold, None
+        with self._lock:
+            for entry_scope, entry_embedding, entry_tokens, response in self._entries:
+                if entry_scope != scope or entry_tokens != tokens:
+                    continue
+                score = sum(map(operator.mul, query, entry_embedding))
+                if score >= best_score:
+                    best_score, best_response = score, response
+            if best_response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best_response
+    
+    def add(self, scope: str, prompt: str, embedding: Sequence[float], response: Any) -> None:
+        """Remember a response; None is never cached."""
+        if response is None:
+            return
+        entry = (scope, self._normalize(embedding), self._critical_tokens(prompt), response)
+        with self._lock:
+            self._entries.append(entry)
+    
+    def stats(self) -> dict:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
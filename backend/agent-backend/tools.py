@@ -1,28 +1,85 @@
+import orjson
 import requests
+from cachetools.func import ttl_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Dict, Any
 
 # --- Constants ---
 API_BASE_URL = 'https://simulator-backend-880917788492.us-central1.run.app'  # Update this to match your backend URL
 
+# Shared session so backend calls reuse pooled keep-alive connections. The pool
+# is sized for concurrent tool calls, and idempotent requests (GETs, not the
+# action POSTs) are retried on transient backend errors.
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+)
+_session = requests.Session()
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+# Statuses toggle_gate accepts; checked locally so bad model output never hits the network
+GATE_STATES = frozenset({'open', 'closed'})
+
+# Bodies are encoded with orjson, so the content type is set explicitly
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Tools called within one agent turn share a single /state fetch
+STATE_CACHE_TTL_SECONDS = 0.5
+
+# ETag and body of the last /state response, so an unchanged state is
+# revalidated with a bodiless 304
+_last_state = (None, None)
+
 # --- Helper Functions ---
+@ttl_cache(maxsize=1, ttl=STATE_CACHE_TTL_SECONDS)
 def _get_state() -> dict:
     """Fetches the complete simulation state from the backend."""
+    global _last_state
+    etag, body = _last_state
+    headers = {'If-None-Match': etag} if etag else None
     try:
-        response = requests.get(f'{API_BASE_URL}/state')
+        response = _session.get(f'{API_BASE_URL}/state', headers=headers)
+        if response.status_code == 304:
+            return body
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        body = orjson.loads(response.content)
+        _last_state = (response.headers.get('ETag'), body)
+        return body
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         raise Exception(f"Error fetching state from backend: {str(e)}")
 
+def _get_json(path: str, params: dict = None) -> dict:
+    """Fetches a filtered view from the backend; None-valued params are omitted."""
+    try:
+        response = _session.get(f'{API_BASE_URL}{path}', params=params)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        raise Exception(f"Error fetching {path} from backend: {str(e)}")
+
 def _post_action(endpoint: str, data: dict) -> dict:
     """Posts an action to the backend and returns the response."""
     try:
-        response = requests.post(f'{API_BASE_URL}{endpoint}', json=data)
+        response = _session.post(f'{API_BASE_URL}{endpoint}', data=orjson.dumps(data), headers=_JSON_HEADERS)
+        # Actions change the state, so the next read must not be served from cache
+        _get_state.cache_clear()
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        return orjson.loads(response.content)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         raise Exception(f"Error posting to {endpoint}: {str(e)}")
 
+def get_active_alerts() -> Dict[str, List[str]]:
+    """Returns the active alerts of every zone that has any, keyed by zone ID."""
+    state = _get_state()
+    return {
+        zone_id: zone_data['active_alerts']
+        for zone_id, zone_data in state.get('zones', {}).items()
+        if zone_data.get('active_alerts')
+    }
+
 # --- Information Retrieval Tools ---
 
 def get_zone_summary(zone_id: str) -> str:
@@ -34,33 +91,28 @@ def get_zone_summary(zone_id: str) -> str:
         return f"Error: Zone '{zone_id}' not found. Use tool 'list_all_zones' to get a list of available zones."
     
     # Build comprehensive summary
-    summary_parts = [
-        f"Zone: {zone_id}",
-        f"Area: {zone_data.get('area_sqm', 'N/A')} sqm",
-        f"People: {zone_data.get('num_people', 'N/A')}",
-        f"Density: {zone_data.get('density_sqm_per_person', 'N/A')} sqm/person",
-        f"Bottleneck Risk: {zone_data.get('bottleneck_risk', 'N/A')}"
-    ]
-    
-    active_alerts = zone_data.get('active_alerts', [])
-    if active_alerts:
-        summary_parts.append(f"Active Alerts: {', '.join(active_alerts)}")
-    else:
-        summary_parts.append("No active alerts")
-    
-    return "\n".join(summary_parts)
+    active_alerts = zone_data.get('active_alerts')
+    return (
+        f"Zone: {zone_id}\n"
+        f"Area: {zone_data.get('area_sqm', 'N/A')} sqm\n"
+        f"People: {zone_data.get('num_people', 'N/A')}\n"
+        f"Density: {zone_data.get('density_sqm_per_person', 'N/A')} sqm/person\n"
+        f"Bottleneck Risk: {zone_data.get('bottleneck_risk', 'N/A')}\n"
+        + (f"Active Alerts: {', '.join(active_alerts)}" if active_alerts else "No active alerts")
+    )
 
 def get_personnel_status(zone_id: str, unit_type: str = 'all') -> str:
     """Finds available personnel in a specific zone. unit_type can be 'medical', 'security', or 'all'."""
-    state = _get_state()
-    personnel = state.get('personnel', {})
-    available_units = []
-    
-    for unit_id, details in personnel.items():
-        if details.get('status') == 'available' and details.get('current_zone') == zone_id:
-            if unit_type == 'all' or details.get('type') == unit_type:
-                available_units.append(f"- {unit_id} ({details.get('name', 'N/A')}, {details.get('type')})")
-                
+    personnel = _get_json('/state/personnel', {
+        'zone_id': zone_id,
+        'type': None if unit_type == 'all' else unit_type,
+        'status': 'available'
+    })
+    available_units = [
+        f"- {unit_id} ({details.get('name', 'N/A')}, {details.get('type')})"
+        for unit_id, details in personnel.items()
+    ]
+    
     if not available_units:
         return f"No available '{unit_type}' units found in {zone_id}."
         
@@ -73,34 +125,26 @@ def list_all_zones() -> List[str]:
 
 def get_personnel_by_zone(zone_id: str) -> List[Dict[str, Any]]:
     """Gets a structured list of all personnel in a specific zone, including their ID, name, type, and status."""
-    state = _get_state()
-    personnel_in_zone = []
-    
-    for unit_id, details in state.get('personnel', {}).items():
-        if details.get('current_zone') == zone_id:
-            personnel_in_zone.append({
-                "id": unit_id,
-                "name": details.get("name"),
-                "type": details.get("type"),
-                "status": details.get("status")
-            })
-    
-    return personnel_in_zone
+    return [
+        {
+            "id": unit_id,
+            "name": details.get("name"),
+            "type": details.get("type"),
+            "status": details.get("status")
+        }
+        for unit_id, details in _get_json('/state/personnel', {'zone_id': zone_id}).items()
+    ]
     
 def list_gates_in_zone(zone_id: str) -> List[Dict[str, Any]]:
     """Gets a structured list of all gates in a specific zone, including their ID and status."""
-    state = _get_state()
-    gates_in_zone = []
-    
-    for gate_id, details in state.get('gates', {}).items():
-        if details.get('zone_id') == zone_id:
-            gates_in_zone.append({
-                "id": gate_id,
-                "status": details.get("status"),
-                "type": details.get("type")
-            })
-    
-    return gates_in_zone
+    return [
+        {
+            "id": gate_id,
+            "status": details.get("status"),
+            "type": details.get("type")
+        }
+        for gate_id, details in _get_json('/state/gates', {'zone_id': zone_id}).items()
+    ]
 
 # --- Action & State Change Tools ---
 
@@ -138,6 +182,9 @@ def dispatch_unit(personnel_id: str, destination_details: str) -> str:
 
 def make_announcement(zone_id: str, message: str) -> str:
     """Makes a public announcement in a specific zone."""
+    if not message or not message.strip():
+        return "Error: Announcement message is empty."
+    
     response = _post_action('/actions/make-announcement', {
         'zone_id': zone_id,
         'message': message
@@ -150,7 +197,7 @@ def make_announcement(zone_id: str, message: str) -> str:
 
 def toggle_gate(gate_id: str, status: str) -> str:
     """Sets a gate's status to 'open' or 'closed'."""
-    if status not in ['open', 'closed']:
+    if status not in GATE_STATES:
         return f"Error: Invalid status '{status}'. Use 'open' or 'closed'."
     
     response = _post_action('/actions/toggle-gate', {
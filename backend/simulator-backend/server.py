@@ -1,14 +1,46 @@
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from datetime import datetime
-import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import logging
+import orjson
+import os
+import queue
 import requests
 import threading
-import time
+import uuid
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='[%(asctime)s] %(levelname)s %(name)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('simulator')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Conversation API endpoint that receives zone alerts. The shared session keeps
+# the HTTPS connection alive between alerts instead of handshaking each time.
+ALERT_URL = os.getenv('ALERT_URL', 'https://agent-backend-880917788492.us-central1.run.app/alert')
+ALERT_TIMEOUT = (1, 3)
+alert_session = requests.Session()
+
 # Mock state
 state = {
     "zones": {
@@ -98,22 +130,163 @@ state = {
     }
 }
 
+# Zones and gates never change zone or type (only gate status does), so the
+# lookups the handlers need are indexed once here
+EMERGENCY_GATE_TYPES = frozenset({'fire_exit', 'emergency_exit'})
+ZONE_GATES = {}
+for _gate_id, _gate in state['gates'].items():
+    ZONE_GATES.setdefault(_gate['zone_id'], []).append((_gate_id, _gate['type']))
+ALL_GATES = tuple((gate_id, gate['type']) for gate_id, gate in state['gates'].items())
+
+ZONE_NAMES_LOWER = tuple((zone_id, zone_id.lower()) for zone_id in state['zones'])
+ZONE_KEYWORDS = (
+    ('hall 1', 'hall_1_lower'),
+    ('hall 2', 'hall_2'),
+    ('entrance', 'entrance_lobby'),
+    ('food', 'food_court'),
+    ('lobby', 'entrance_lobby')
+)
+
+# /state is served from a cached serialization tagged with a version number.
+# Every mutation of state must call invalidate_state_cache() afterwards; the
+# boot id keeps ETags from an earlier process from matching after a restart.
+_BOOT_ID = uuid.uuid4().hex[:8]
+_state_version = 0
+_state_cache = None
+
+# /state/stream subscribers, one queue of ready-to-send SSE events each. Ticks
+# of a gradual simulation pass their zone_id and publish only that zone's
+# population; other mutations publish the full state. A subscriber that falls
+# STREAM_QUEUE_SIZE events behind (a stalled tab or proxy) has its backlog
+# replaced by one full-state event, so memory per subscriber stays bounded.
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_QUEUE_SIZE = 64
+_state_subscribers = set()
+_state_subscribers_lock = threading.Lock()
+
+def serialized_state():
+    """Return (version, JSON bytes) of state, re-serializing only if it changed."""
+    global _state_cache
+    # Read the version before serializing so a concurrent mutation can only
+    # make the body newer than its tag, never older
+    version = _state_version
+    cached = _state_cache
+    if cached is None or cached[0] != version:
+        cached = _state_cache = (version, orjson.dumps(state))
+    return cached
+
+def _state_event():
+    """SSE event carrying the full current state."""
+    return b"event: state\ndata: " + serialized_state()[1] + b"\n\n"
+
+def _publish(subscriber, event):
+    """Queue event for a subscriber, resetting a full backlog to the current state."""
+    try:
+        subscriber.put_nowait(event)
+        return
+    except queue.Full:
+        pass
+    # The snapshot already includes this event's change
+    while True:
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            break
+    subscriber.put_nowait(_state_event())
+
+def invalidate_state_cache(zone_id=None):
+    """Mark the cached /state serialization stale after a mutation and notify stream subscribers."""
+    global _state_version
+    _state_version += 1
+    if not _state_subscribers:
+        return
+    if zone_id is None:
+        event = _state_event()
+    else:
+        zone = state['zones'][zone_id]
+        event = b"event: zone\ndata: " + orjson.dumps({
+            'zone_id': zone_id,
+            'num_people': zone['num_people'],
+            'density_sqm_per_person': zone['density_sqm_per_person']
+        }) + b"\n\n"
+    with _state_subscribers_lock:
+        for subscriber in _state_subscribers:
+            _publish(subscriber, event)
+
 def log_request(method, path, body=None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"\n[{timestamp}] {method} {path}")
+    """Log an incoming request at DEBUG; the body is only serialized when DEBUG is enabled."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     if body:
-        print(f"Body: {json.dumps(body, indent=2)}")
-    print("-" * 50)
+        logger.debug("%s %s %s", method, path, orjson.dumps(body).decode())
+    else:
+        logger.debug("%s %s", method, path)
 
 def remove_alert_from_zone(zone_id, alert_type):
     """Helper function to remove an alert from a zone."""
     if zone_id in state['zones'] and alert_type in state['zones'][zone_id]['active_alerts']:
         state['zones'][zone_id]['active_alerts'].remove(alert_type)
+        invalidate_state_cache()
         print(f"Resolved {alert_type} alert in {zone_id}")
         return True
     return False
 
-def gradual_evacuate_zone(zone_id):
+# At most one gradual simulation runs per zone; starting another (say crowd
+# control while an overcrowding ramp is still going) cancels the running one
+# instead of letting both write the zone's population
+SIMULATION_STEP_SECONDS = 0.5
+_zone_simulations = {}
+_zone_simulations_lock = threading.Lock()
+
+# Shared pool for gradual simulations (avoids a new thread per trigger). A
+# cancelled simulation returns at its next tick, so a small pool suffices.
+MAX_SIMULATION_WORKERS = 16
+simulation_executor = ThreadPoolExecutor(max_workers=MAX_SIMULATION_WORKERS, thread_name_prefix='sim-worker')
+
+def start_zone_simulation(zone_id, target, *args):
+    """Run target(zone_id, *args, cancelled=event) in the background, cancelling the zone's current simulation."""
+    cancelled = threading.Event()
+    with _zone_simulations_lock:
+        previous = _zone_simulations.get(zone_id)
+        if previous is not None:
+            previous.set()
+        _zone_simulations[zone_id] = cancelled
+    simulation_executor.submit(_run_zone_simulation, zone_id, target, args, cancelled)
+
+def _run_zone_simulation(zone_id, target, args, cancelled):
+    try:
+        target(zone_id, *args, cancelled=cancelled)
+    except Exception:
+        # The pool would otherwise hold the error on a future nobody reads
+        logger.exception("Simulation in %s failed", zone_id)
+    finally:
+        with _zone_simulations_lock:
+            if _zone_simulations.get(zone_id) is cancelled:
+                del _zone_simulations[zone_id]
+
+def run_population_schedule(zone_id, counts, label, cancelled):
+    """Step a zone's population through counts, one per SIMULATION_STEP_SECONDS.
+    
+    Densities are computed up front so each tick is two assignments. Returns
+    False if the simulation was cancelled part-way.
+    """
+    zone = state['zones'][zone_id]
+    area = zone['area_sqm']
+    densities = [area / count if count > 0 else 0 for count in counts]
+    previous = zone['num_people']
+    for count, density in zip(counts, densities):
+        zone['num_people'] = count
+        zone['density_sqm_per_person'] = density
+        invalidate_state_cache(zone_id)
+        
+        print(f"{label} {zone_id}: {previous} -> {count}")
+        previous = count
+        if cancelled.wait(SIMULATION_STEP_SECONDS):
+            print(f"Simulation in {zone_id} cancelled by a newer one")
+            return False
+    return True
+
+def gradual_evacuate_zone(zone_id, *, cancelled):
     """Gradually reduce people count to 0 over 10 seconds."""
     if zone_id not in state['zones']:
         return
@@ -121,22 +294,11 @@ def gradual_evacuate_zone(zone_id):
     initial_count = state['zones'][zone_id]['num_people']
     steps = 20  # 20 updates over 10 seconds
     
-    for i in range(steps):
-        current_count = state['zones'][zone_id]['num_people']
-        # Reduce by 5% of initial count each step
-        reduction = int(initial_count * 0.05)
-        new_count = max(0, current_count - reduction)
-        
-        state['zones'][zone_id]['num_people'] = new_count
-        if new_count > 0:
-            state['zones'][zone_id]['density_sqm_per_person'] = (
-                state['zones'][zone_id]['area_sqm'] / new_count
-            )
-        else:
-            state['zones'][zone_id]['density_sqm_per_person'] = 0
-        
-        print(f"Evacuating {zone_id}: {current_count} -> {new_count}")
-        time.sleep(0.5)
+    # Reduce by 5% of initial count each step
+    reduction = int(initial_count * 0.05)
+    counts = [max(0, initial_count - reduction * step) for step in range(1, steps + 1)]
+    if not run_population_schedule(zone_id, counts, "Evacuating", cancelled):
+        return
     
     # Ensure it's 0 at the end
     state['zones'][zone_id]['num_people'] = 0
@@ -144,12 +306,13 @@ def gradual_evacuate_zone(zone_id):
     
     # Set risk to low when zone is empty
     state['zones'][zone_id]['bottleneck_risk'] = 'low'
+    invalidate_state_cache()
     
     # Resolve Fire alerts after evacuation
     remove_alert_from_zone(zone_id, 'Fire')
     print(f"Evacuation of {zone_id} complete - risk set to low")
 
-def gradual_overcrowd_zone(zone_id, event_type):
+def gradual_overcrowd_zone(zone_id, event_type, session_id=None, *, cancelled):
     """Gradually increase people count to 3000 over 5 seconds."""
     if zone_id not in state['zones']:
         return
@@ -166,41 +329,25 @@ def gradual_overcrowd_zone(zone_id, event_type):
         # Already at target
         return
     
-    for i in range(steps):
-        current_count = state['zones'][zone_id]['num_people']
-        if change_per_step > 0:
-            new_count = min(target_count, current_count + change_per_step)
-        else:
-            new_count = max(target_count, current_count + change_per_step)
-        
-        state['zones'][zone_id]['num_people'] = new_count
-        state['zones'][zone_id]['density_sqm_per_person'] = (
-            state['zones'][zone_id]['area_sqm'] / new_count
-        )
-        
-        print(f"Overcrowding {zone_id}: {current_count} -> {new_count}")
-        time.sleep(0.5)
+    clamp = min if change_per_step > 0 else max
+    counts = [clamp(target_count, initial_count + change_per_step * step) for step in range(1, steps + 1)]
+    if not run_population_schedule(zone_id, counts, "Overcrowding", cancelled):
+        return
     
     # Ensure we reach the target
     state['zones'][zone_id]['num_people'] = target_count
     state['zones'][zone_id]['density_sqm_per_person'] = (
         state['zones'][zone_id]['area_sqm'] / target_count
     )
+    invalidate_state_cache()
     
     final_density = state['zones'][zone_id]['density_sqm_per_person']
     print(f"Overcrowding of {zone_id} complete: {initial_count} -> {target_count} people (density: {final_density:.2f} m²/person)")
     
     # Send alert to conversation API after overcrowding completes
-    try:
-        alert_response = requests.post('https://agent-backend-880917788492.us-central1.run.app/alert', json={
-            'type': event_type,
-            'zone': zone_id
-        })
-        print(f"Alert sent to conversation API: {alert_response.status_code}")
-    except Exception as e:
-        print(f"Failed to send alert to conversation API: {e}")
+    send_alert(event_type, zone_id, session_id)
 
-def gradual_crowd_control(zone_id):
+def gradual_crowd_control(zone_id, *, cancelled):
     """Gradually reduce people count to 500 over 10 seconds."""
     if zone_id not in state['zones']:
         return
@@ -216,17 +363,9 @@ def gradual_crowd_control(zone_id):
         # If already below 500, no need to reduce
         return
     
-    for i in range(steps):
-        current_count = state['zones'][zone_id]['num_people']
-        new_count = max(target_count, current_count - reduction_per_step)
-        
-        state['zones'][zone_id]['num_people'] = new_count
-        state['zones'][zone_id]['density_sqm_per_person'] = (
-            state['zones'][zone_id]['area_sqm'] / new_count
-        )
-        
-        print(f"Crowd control in {zone_id}: {current_count} -> {new_count}")
-        time.sleep(0.5)
+    counts = [max(target_count, initial_count - reduction_per_step * step) for step in range(1, steps + 1)]
+    if not run_population_schedule(zone_id, counts, "Crowd control in", cancelled):
+        return
     
     # Ensure we reach exactly 500
     state['zones'][zone_id]['num_people'] = target_count
@@ -236,6 +375,7 @@ def gradual_crowd_control(zone_id):
     
     # Update risk level to low when crowd is controlled
     state['zones'][zone_id]['bottleneck_risk'] = 'low'
+    invalidate_state_cache()
     
     # Resolve Overcrowding and Stampede alerts
     remove_alert_from_zone(zone_id, 'Overcrowding')
@@ -244,29 +384,131 @@ def gradual_crowd_control(zone_id):
     final_density = state['zones'][zone_id]['density_sqm_per_person']
     print(f"Crowd control in {zone_id} complete: {initial_count} -> {target_count} people (density: {final_density:.2f} m²/person)")
 
+def send_alert(event_type, zone_id, session_id=None):
+    """Post a zone alert to the conversation API, logging rather than raising on failure."""
+    try:
+        alert_response = alert_session.post(ALERT_URL, json=alert_payload(event_type, zone_id, session_id), timeout=ALERT_TIMEOUT)
+        print(f"Alert sent to conversation API: {alert_response.status_code}")
+    except Exception as e:
+        print(f"Failed to send alert to conversation API: {e}")
+
+def alert_payload(event_type, zone_id, session_id=None):
+    """Build the /alert body; without a session_id the agent broadcasts to all sessions."""
+    payload = {'type': event_type, 'zone': zone_id}
+    if session_id:
+        payload['session_id'] = session_id
+    return payload
+
+@lru_cache(maxsize=512)
 def get_zone_for_destination(destination_details):
-    """Extract zone from destination details string."""
+    """Extract zone from destination details string.
+    
+    Memoized: the result depends only on the string, since zone names and
+    keywords are fixed at import.
+    """
+    destination = destination_details.lower()
     # Simple heuristic - check if any zone name appears in the destination
-    for zone_id in state['zones'].keys():
-        if zone_id.lower() in destination_details.lower():
+    for zone_id, zone_name in ZONE_NAMES_LOWER:
+        if zone_name in destination:
             return zone_id
     # Check for zone names in the destination
-    zone_keywords = {
-        'hall 1': 'hall_1_lower',
-        'hall 2': 'hall_2',
-        'entrance': 'entrance_lobby',
-        'food': 'food_court',
-        'lobby': 'entrance_lobby'
-    }
-    for keyword, zone in zone_keywords.items():
-        if keyword in destination_details.lower():
+    for keyword, zone in ZONE_KEYWORDS:
+        if keyword in destination:
             return zone
     return None
 
 @app.route('/state', methods=['GET'])
 def get_state():
     log_request('GET', '/state')
-    return jsonify(state)
+    version, body = serialized_state()
+    # ETag lets pollers revalidate an unchanged state without the body
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(f"{_BOOT_ID}-{version}", weak=True)
+    return response.make_conditional(request)
+
+@app.route('/state/stream', methods=['GET'])
+def stream_state():
+    """Server-Sent Events: a full 'state' event on connect, then one event per mutation."""
+    log_request('GET', '/state/stream')
+    
+    def generate():
+        subscriber = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with _state_subscribers_lock:
+            _state_subscribers.add(subscriber)
+        try:
+            yield _state_event()
+            while True:
+                try:
+                    yield subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield b": ping\n\n"
+        finally:
+            with _state_subscribers_lock:
+                _state_subscribers.discard(subscriber)
+    
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/state/personnel', methods=['GET'])
+def get_personnel():
+    """Personnel keyed by ID, filtered by the optional zone_id, type and status query parameters."""
+    filters = {
+        'current_zone': request.args.get('zone_id'),
+        'type': request.args.get('type'),
+        'status': request.args.get('status')
+    }
+    log_request('GET', '/state/personnel', request.args.to_dict())
+    return jsonify({
+        unit_id: details for unit_id, details in state['personnel'].items()
+        if all(value is None or details.get(key) == value for key, value in filters.items())
+    })
+
+@app.route('/state/gates', methods=['GET'])
+def get_gates():
+    """Gates keyed by ID, filtered by the optional zone_id query parameter."""
+    zone_id = request.args.get('zone_id')
+    log_request('GET', '/state/gates', request.args.to_dict())
+    return jsonify({
+        gate_id: details for gate_id, details in state['gates'].items()
+        if zone_id is None or details.get('zone_id') == zone_id
+    })
+
+# --- Event side effects, beyond adding the alert to the zone ---
+
+def _set_critical_risk(zone):
+    state['zones'][zone]['bottleneck_risk'] = 'critical'
+    print(f"Set {zone} risk to critical")
+
+def _handle_fire(zone, session_id):
+    # Open fire exits in affected zone
+    for gate_id, gate_type in ZONE_GATES.get(zone, ()):
+        if gate_type in EMERGENCY_GATE_TYPES:
+            state['gates'][gate_id]['status'] = 'open'
+            print(f"Opened gate {gate_id}")
+
+def _handle_overcrowding(zone, session_id):
+    _set_critical_risk(zone)
+    # Start gradual population increase
+    print(f"Starting overcrowding simulation for {zone}")
+    start_zone_simulation(zone, gradual_overcrowd_zone, "Overcrowding", session_id)
+
+def _handle_stampede(zone, session_id):
+    _set_critical_risk(zone)
+
+def _no_side_effects(zone, session_id):
+    pass
+
+# Event types accepted by /event, each mapped to its side effects
+EVENT_HANDLERS = {
+    "Overcrowding": _handle_overcrowding,
+    "MedicalEmergency": _no_side_effects,
+    "Fire": _handle_fire,
+    "SecurityThreat": _no_side_effects,
+    "Stampede": _handle_stampede
+}
 
 @app.route('/event', methods=['POST'])
 def trigger_event():
@@ -275,6 +517,7 @@ def trigger_event():
     
     event_type = data.get('type')
     zone = data.get('zone')
+    session_id = data.get('session_id')
     
     # Validate zone
     if zone not in state['zones']:
@@ -284,8 +527,7 @@ def trigger_event():
         }), 400
     
     # Validate event type
-    valid_types = ["Overcrowding", "MedicalEmergency", "Fire", "SecurityThreat", "Stampede"]
-    if event_type not in valid_types:
+    if event_type not in EVENT_HANDLERS:
         return jsonify({
             "status": "error",
             "message": "Invalid event type provided."
@@ -297,34 +539,13 @@ def trigger_event():
         print(f"Added {event_type} alert to {zone}")
     
     # Simulate state changes based on event type
-    if event_type == "Fire":
-        # Open fire exits in affected zone
-        for gate_id, gate in state['gates'].items():
-            if gate['zone_id'] == zone and gate['type'] in ['fire_exit', 'emergency_exit']:
-                state['gates'][gate_id]['status'] = 'open'
-                print(f"Opened gate {gate_id}")
-    
-    if event_type in ["Overcrowding", "Stampede"]:
-        state['zones'][zone]['bottleneck_risk'] = 'critical'
-        print(f"Set {zone} risk to critical")
-        
-        # For Overcrowding, start gradual population increase
-        if event_type == "Overcrowding":
-            print(f"Starting overcrowding simulation for {zone}")
-            thread = threading.Thread(target=gradual_overcrowd_zone, args=(zone, event_type))
-            thread.daemon = True
-            thread.start()
-    
-    # Send alert to conversation API (except for Overcrowding which sends after 5s)
+    EVENT_HANDLERS[event_type](zone, session_id)
+    invalidate_state_cache()
+    
+    # Send alert to conversation API (except for Overcrowding which sends after 5s).
+    # Sent in the background so the response doesn't wait on the agent backend.
     if event_type != "Overcrowding":
-        try:
-            alert_response = requests.post('/alert', json={
-                'type': event_type,
-                'zone': zone
-            })
-            print(f"Alert sent to conversation API: {alert_response.status_code}")
-        except Exception as e:
-            print(f"Failed to send alert to conversation API: {e}")
+        simulation_executor.submit(send_alert, event_type, zone, session_id)
     
     return jsonify({
         "status": "success",
@@ -346,6 +567,7 @@ def toggle_gate():
         }), 400
     
     state['gates'][gate_id]['status'] = status
+    invalidate_state_cache()
     print(f"Set gate {gate_id} to {status}")
     
     return jsonify({
@@ -373,6 +595,7 @@ def dispatch_unit():
     
     # Update unit status
     state['personnel'][personnel_id]['status'] = 'dispatched'
+    invalidate_state_cache()
     print(f"Dispatched {personnel_id} to {destination}")
     
     # Resolve alerts based on unit type and destination
@@ -419,24 +642,20 @@ def evacuate():
         }), 400
     
     # Open all emergency exits
-    for gate_id, gate in state['gates'].items():
-        if zone_id == 'all' or gate['zone_id'] == zone_id:
-            if gate['type'] != 'main_gate':
-                state['gates'][gate_id]['status'] = 'open'
-                print(f"Opened gate {gate_id}")
+    for gate_id, gate_type in ALL_GATES if zone_id == 'all' else ZONE_GATES.get(zone_id, ()):
+        if gate_type != 'main_gate':
+            state['gates'][gate_id]['status'] = 'open'
+            print(f"Opened gate {gate_id}")
+    invalidate_state_cache()
     
     # Start gradual evacuation in background threads
     if zone_id == 'all':
         for zone in state['zones']:
             print(f"Starting evacuation of {zone}")
-            thread = threading.Thread(target=gradual_evacuate_zone, args=(zone,))
-            thread.daemon = True
-            thread.start()
+            start_zone_simulation(zone, gradual_evacuate_zone)
     else:
         print(f"Starting evacuation of {zone_id}")
-        thread = threading.Thread(target=gradual_evacuate_zone, args=(zone_id,))
-        thread.daemon = True
-        thread.start()
+        start_zone_simulation(zone_id, gradual_evacuate_zone)
     
     return jsonify({
         "status": "success",
@@ -457,16 +676,15 @@ def activate_crowd_control():
         }), 400
     
     # Open non-main gates in zone
-    for gate_id, gate in state['gates'].items():
-        if gate['zone_id'] == zone_id and gate['type'] != 'main_gate':
+    for gate_id, gate_type in ZONE_GATES.get(zone_id, ()):
+        if gate_type != 'main_gate':
             state['gates'][gate_id]['status'] = 'open'
             print(f"Opened gate {gate_id}")
+    invalidate_state_cache()
     
     # Start gradual crowd reduction in background thread
     print(f"Starting crowd control protocol for {zone_id}")
-    thread = threading.Thread(target=gradual_crowd_control, args=(zone_id,))
-    thread.daemon = True
-    thread.start()
+    start_zone_simulation(zone_id, gradual_crowd_control)
     
     return jsonify({
         "status": "success",
@@ -490,10 +708,11 @@ def dispatch_fire_brigade():
     print(f"Fire brigade dispatched to {zone_id}")
     
     # Open fire and emergency exits in the zone
-    for gate_id, gate in state['gates'].items():
-        if gate['zone_id'] == zone_id and gate['type'] in ['fire_exit', 'emergency_exit']:
+    for gate_id, gate_type in ZONE_GATES.get(zone_id, ()):
+        if gate_type in EMERGENCY_GATE_TYPES:
             state['gates'][gate_id]['status'] = 'open'
             print(f"Opened gate {gate_id}")
+    invalidate_state_cache()
     
     # Fire alerts will be resolved after evacuation if needed
     # The fire brigade arrival doesn't immediately resolve the alert
@@ -505,10 +724,12 @@ def dispatch_fire_brigade():
     })
 
 if __name__ == '__main__':
+    # Development server only; production runs under gunicorn's gevent worker
+    # (see Dockerfile)
     print("\n" + "="*50)
     print("Project Drishti Mock Server")
     print("="*50)
     print("Server starting on http://localhost:3001")
     print("="*50 + "\n")
     
-    app.run(host='0.0.0.0', port=3001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=3001, debug=False, threaded=True)
\ No newline at end of file
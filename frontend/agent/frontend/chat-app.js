@@ -230,12 +230,8 @@ async function pollForUpdates(loadingDiv) {
                 }
             }
             
+            // The server holds /poll open until items arrive, so re-poll immediately
             complete = data.complete;
-            
-            // Small delay between polls
-            if (!complete) {
-                await new Promise(resolve => setTimeout(resolve, 100));
-            }
         } catch (error) {
             if (loadingDiv && loadingDiv.parentNode) {
                 loadingDiv.remove();
@@ -251,6 +247,55 @@ async function pollForUpdates(loadingDiv) {
     }
 }
 
+// Stream queue updates over Server-Sent Events
+function streamUpdates(loadingDiv) {
+    // Fall back to polling on browsers without EventSource
+    if (typeof EventSource === 'undefined') {
+        return pollForUpdates(loadingDiv);
+    }
+    
+    return new Promise(resolve => {
+        const source = new EventSource(CHAT_API_URL + '/stream?session_id=' + encodeURIComponent(sessionId));
+        
+        const removeLoading = () => {
+            if (loadingDiv && loadingDiv.parentNode) {
+                loadingDiv.remove();
+                loadingDiv = null;
+            }
+        };
+        
+        const finish = () => {
+            source.close();
+            removeLoading();
+            resolve();
+        };
+        
+        source.onmessage = (event) => {
+            const item = JSON.parse(event.data);
+            
+            if (item.type === 'function_call') {
+                removeLoading();
+                displayFunctionCalls([item.content]);
+            } else if (item.type === 'text') {
+                removeLoading();
+                addMessage(item.content, false);
+            } else if (item.type === 'error') {
+                removeLoading();
+                addMessage(`Error: ${item.content}`, false);
+                finish();
+            } else if (item.type === 'end') {
+                finish();
+            }
+        };
+        
+        source.onerror = () => {
+            removeLoading();
+            addMessage('Streaming connection lost', false);
+            finish();
+        };
+    });
+}
+
 // Send message to chat API
 async function sendMessage(message) {
     // Add user message to chat
@@ -277,8 +322,8 @@ async function sendMessage(message) {
         const data = await response.json();
         
         if (data.status === 'processing') {
-            // Start polling for updates
-            await pollForUpdates(loadingDiv);
+            // Start streaming updates
+            await streamUpdates(loadingDiv);
         } else if (data.error) {
             loadingDiv.remove();
             addMessage(`Error: ${data.error}`, false);
@@ -380,8 +425,8 @@ async function pollForAlerts() {
             loadingDiv.innerHTML = '<div class="message-content"><strong>Drishti AI:</strong> <span class="dots">...</span></div>';
             chatMessages.appendChild(loadingDiv);
             
-            // Start polling for the agent's response to this alert
-            await pollForUpdates(loadingDiv);
+            // Stream the agent's response to this alert
+            await streamUpdates(loadingDiv);
         }
     } catch (error) {
         console.error('Error polling for alerts:', error);
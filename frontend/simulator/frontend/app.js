@@ -321,31 +321,19 @@ class EventHandlers {
     }
 }
 
-// Main update function
-async function updateState() {
-    try {
-        const state = await ApiService.fetchState();
-        AppState.currentState = state;
-        
-        // Update connection status
-        if (!AppState.isConnected) {
-            AppState.isConnected = true;
-            const statusEl = document.getElementById('connection-status');
-            statusEl.textContent = 'Connected';
-            statusEl.classList.add('connected');
-            Logger.log('Connected to server', 'success');
-        }
-        
-        // Update UI
-        ZoneRenderer.renderAllZones(state.zones);
-        InfoPanelRenderer.renderPersonnel(state.personnel);
-        InfoPanelRenderer.renderGates(state.gates);
-        
-        // Update last update time
-        document.getElementById('last-update').textContent = 
-            `Last update: ${new Date().toLocaleTimeString()}`;
-            
-    } catch (error) {
+// Connection status helpers
+function markConnected() {
+    if (!AppState.isConnected) {
+        AppState.isConnected = true;
+        const statusEl = document.getElementById('connection-status');
+        statusEl.textContent = 'Connected';
+        statusEl.classList.add('connected');
+        Logger.log('Connected to server', 'success');
+    }
+}
+
+function markDisconnected() {
+    if (AppState.isConnected) {
         AppState.isConnected = false;
         const statusEl = document.getElementById('connection-status');
         statusEl.textContent = 'Disconnected';
@@ -354,6 +342,59 @@ async function updateState() {
     }
 }
 
+function markUpdated() {
+    document.getElementById('last-update').textContent = 
+        `Last update: ${new Date().toLocaleTimeString()}`;
+}
+
+// Render a full state snapshot
+function applyState(state) {
+    AppState.currentState = state;
+    markConnected();
+    
+    // Update UI
+    ZoneRenderer.renderAllZones(state.zones);
+    InfoPanelRenderer.renderPersonnel(state.personnel);
+    InfoPanelRenderer.renderGates(state.gates);
+    markUpdated();
+}
+
+// Apply a zone population delta from the state stream
+function applyZoneDelta(delta) {
+    const zone = AppState.currentState && AppState.currentState.zones[delta.zone_id];
+    if (!zone) return;
+    
+    zone.num_people = delta.num_people;
+    zone.density_sqm_per_person = delta.density_sqm_per_person;
+    ZoneRenderer.renderAllZones(AppState.currentState.zones);
+    markUpdated();
+}
+
+// Main update function (polling fallback)
+async function updateState() {
+    try {
+        applyState(await ApiService.fetchState());
+    } catch (error) {
+        markDisconnected();
+    }
+}
+
+// Receive pushed state changes; the server sends a full snapshot on connect
+// and after discrete actions, and small zone deltas for each population tick.
+// EventSource reconnects on its own after an error.
+function subscribeToState() {
+    if (!window.EventSource) {
+        updateState();
+        setInterval(updateState, CONFIG.POLL_INTERVAL);
+        return;
+    }
+    
+    const source = new EventSource(`${CONFIG.API_BASE_URL}/state/stream`);
+    source.addEventListener('state', (event) => applyState(JSON.parse(event.data)));
+    source.addEventListener('zone', (event) => applyZoneDelta(JSON.parse(event.data)));
+    source.onerror = markDisconnected;
+}
+
 // Initialize application
 function initializeApp() {
     Logger.log('Initializing Project Drishti Dashboard...', 'info');
@@ -363,9 +404,8 @@ function initializeApp() {
     EventHandlers.setupZoneClicks();
     EventHandlers.setupGateClicks();
     
-    // Start polling for updates
-    updateState();
-    setInterval(updateState, CONFIG.POLL_INTERVAL);
+    // Start receiving state updates
+    subscribeToState();
     
     Logger.log('Dashboard initialized successfully', 'success');
 }